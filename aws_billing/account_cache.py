@@ -0,0 +1,58 @@
+import json
+import os
+import threading
+import time
+
+from .response_cache import CACHE_DIR
+
+ACCOUNTS_TTL = 24 * 60 * 60  # seconds
+
+
+class AccountCache:
+    """On-disk copy of an organization's account list, with a TTL.
+
+    One JSON file per profile holds the account records and when they were
+    fetched. Loaded records are also kept in memory for the life of the
+    process, so repeated lookups never touch the disk or Organizations.
+    """
+
+    _memory = {}
+    _lock = threading.Lock()
+
+    def __init__(self, namespace=None, ttl=ACCOUNTS_TTL, path=None):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, f"accounts-{namespace or 'default'}.json")
+        self.path = path
+        self.ttl = ttl
+
+    def load(self, allow_stale=False):
+        """Returns the cached account records, or None if missing or expired.
+
+        Args:
+            allow_stale: Return expired records too, e.g. when a refresh from
+                Organizations failed.
+        """
+
+        with self._lock:
+            entry = self._memory.get(self.path)
+        if entry is None:
+            try:
+                with open(self.path) as cache_file:
+                    entry = json.load(cache_file)
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                self._memory[self.path] = entry
+        if not allow_stale and time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return entry["accounts"]
+
+    def save(self, records):
+        entry = {"fetched_at": time.time(), "accounts": records}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temporary, self.path)
+        with self._lock:
+            self._memory[self.path] = entry
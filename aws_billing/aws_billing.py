@@ -1,47 +1,60 @@
-import boto3
+from __future__ import annotations
+
+import functools
+import importlib.util
 import os
+import time
 from pprint import pprint
-from tabulate import tabulate
-import sys
 import datetime
 import click
 
-sys.path.insert(0, "./aws_billing/objects")
-from classes import Account, find_account
-from typing import Optional, List
-from pydantic import ValidationError
+from .objects.directory import AccountDirectory
+from .account_cache import AccountCache
+from .clients import CLIENTS
+from .metrics import METRICS
+from .history import (
+    RESTATEMENT_DAYS,
+    CostHistoryStore,
+    service_report_id,
+    tag_report_id,
+)
+from .response_cache import (
+    CachingClient,
+    ResponseCache,
+    is_closed_period,
+)
+from .throttle import CE_REQUESTS_PER_SECOND, ThrottledClient, TokenBucket, fan_out
+from typing import TYPE_CHECKING, List
 from collections import defaultdict
-import pandas as pd
+
+if TYPE_CHECKING:
+    import boto3
+
+    from .objects.classes import Account
+
+# boto3, openpyxl, pydantic and tabulate are imported where they are
+# used so that --help and light subcommands do not pay for them.
 
 AWS_PROFILE = os.getenv("AWS_PROFILE")
+TAG_VALUES_PER_QUERY = 500
+TAG_CHUNK_WORKERS = 4  # chunk queries of one tag report run at once
+PREVIEW_ROWS = 20
+PERIOD_HEADERS = ["Period Start", "Period End"]
+ACCOUNT_HEADERS = ["Account Name", "Scope", "Charges", "Currency", *PERIOD_HEADERS]
+SERVICE_HEADERS = [
+    "Account Name",
+    "AWS Service",
+    "Charges",
+    "Currency",
+    *PERIOD_HEADERS,
+]
+TAG_HEADERS = ["Service", "Tag", "Usage Type", "Charges", "Currency", *PERIOD_HEADERS]
 ACCOUNT_LIST = list()
 TODAY = datetime.date.today()
 FIRST = TODAY.replace(day=1)
 LAST_MONTH = FIRST - datetime.timedelta(days=1)
 
 
-# helper function
-def check_elements_not_in_string(my_list, my_string):
-    """
-    Checks if each element of a list is NOT present in a given string.
-
-    Args:
-        my_list: The list of elements to check.
-        my_string: The string to check against.
-
-    Returns:
-        True if ALL elements of the list are NOT in the string, False otherwise.
-    """
-    if my_list is None:
-        return True
-    if my_list is None:
-        return True
-    for element in my_list:
-        if element in my_string:  # Or if str(element) in my_string for mixed types
-            return False  # If even ONE element is found, return False immediately
-    return True  # If the loop completes without finding any element, return True
-
-
 def sum_by_group(data):
     """Sums values associated with keys in a list of tuples/lists.
 
@@ -78,16 +91,92 @@ def sum_by_group(data):
     return result
 
 
+def print_table(table):
+    """Prints a table in the fancy_grid format, using its first row as headers."""
+    from tabulate import tabulate
+
+    print(tabulate(table, headers="firstrow", tablefmt="fancy_grid"))
+
+
+@METRICS.timed("client_setup")
 def get_org_client(aws_profile_name=AWS_PROFILE):
-    session = boto3.Session(profile_name=aws_profile_name)
-    client = session.client("organizations")
-    return client
+    return CLIENTS.client("organizations", aws_profile_name)
 
 
+@METRICS.timed("client_setup")
 def get_ce_client(aws_profile_name=AWS_PROFILE):
-    session = boto3.Session(profile_name=aws_profile_name)
-    client = session.client("ce")
-    return client
+    return CLIENTS.client("ce", aws_profile_name)
+
+
+def iter_cost_and_usage_groups(boto3_client: boto3.client, **request):
+    """Yields every group of a get_cost_and_usage query, page by page.
+
+    Follows NextPageToken until Cost Explorer stops returning one and walks
+    every ResultsByTime period, so paginated LINKED_ACCOUNT x SERVICE
+    groupings and multi-period or DAILY ranges are never truncated. Groups
+    are yielded lazily, so only one page is held in memory at a time.
+
+    Args:
+        boto3_client: A boto3 client for AWS Cost Explorer.
+        **request: Keyword arguments passed to get_cost_and_usage.
+
+    Yields:
+        Group dictionaries, each tagged with the "TimePeriod" and "Estimated"
+        flag of its result.
+    """
+
+    while True:
+        response = boto3_client.get_cost_and_usage(**request)
+        for result in response.get("ResultsByTime", []):
+            period = result.get("TimePeriod", {})
+            estimated = bool(result.get("Estimated"))
+            for group in result.get("Groups", []):
+                group["TimePeriod"] = period
+                group["Estimated"] = estimated
+                yield group
+        next_page_token = response.get("NextPageToken")
+        if not next_page_token:
+            return
+        request = {**request, "NextPageToken": next_page_token}
+
+
+def fetch_cost_groups(boto3_client, store=None, report=None, fetch=None, **request):
+    """Returns the groups of a get_cost_and_usage query, through the history
+    store when one is given.
+
+    With an offline store that covers the requested period the groups are
+    read locally and Cost Explorer is not called; otherwise they are fetched
+    with iter_cost_and_usage_groups and recorded in the store as they pass.
+    Waiting for the groups is recorded as the "fetch_cost_groups" stage (see
+    metrics.Metrics.timed_iter), apart from the processing that consumes
+    them.
+
+    Args:
+        boto3_client: A boto3 client for AWS Cost Explorer.
+        store: An optional CostHistoryStore.
+        report: The store's report id for this query.
+        fetch: An optional callable returning the live groups, used instead
+            of a single iter_cost_and_usage_groups(**request) query.
+        **request: Keyword arguments passed to get_cost_and_usage.
+    """
+
+    if fetch is None:
+        fetch = functools.partial(iter_cost_and_usage_groups, boto3_client, **request)
+    if store is None or report is None:
+        return METRICS.timed_iter("fetch_cost_groups", fetch())
+    start = request["TimePeriod"]["Start"]
+    end = request["TimePeriod"]["End"]
+    if store.offline:
+        granularity = store.covering_granularity(report, start, end)
+        if granularity:
+            return METRICS.timed_iter(
+                "fetch_cost_groups", store.iter_groups(report, start, end, granularity)
+            )
+        print(f"History store does not cover {report} {start}..{end}")
+    return METRICS.timed_iter(
+        "fetch_cost_groups",
+        store.record(report, request["Granularity"], start, end, fetch()),
+    )
 
 
 def close_account_from_org(boto3_client, account_id):
@@ -102,12 +191,18 @@ def close_account_from_org(boto3_client, account_id):
         pprint(f"Aborting closure of account: {account_id}")
 
 
-def get_list_of_accounts(boto3_client: boto3.client) -> List[Account]:
+@METRICS.timed("get_list_of_accounts", rows=len)
+def get_list_of_accounts(
+    boto3_client: boto3.client, show=False, strict=False
+) -> List[Account]:
     """Fetches a paginated list of accounts using boto3, creates Account objects,
     and returns them in a list.
 
     Args:
-        boto3_client: A boto3 client for AWS IAM.
+        boto3_client: A boto3 client for AWS Organizations.
+        show: Print the accounts as a table (see print_accounts).
+        strict: Fully validate every account (including the root email)
+            instead of trusting the Organizations API (see Account.trusted).
 
     Returns:
         A list of Account objects representing the retrieved accounts.
@@ -117,161 +212,321 @@ def get_list_of_accounts(boto3_client: boto3.client) -> List[Account]:
     paginator = boto3_client.get_paginator("list_accounts")
 
     for page in paginator.paginate():
-        accounts = page.get("Accounts", [])
-        for account in accounts:
-            try:
-                account_data = {
+        account_list += build_accounts(
+            (
+                {
                     "account_id": account.get("Id"),
                     "account_name": account.get("Name"),
                     "root_email": account.get("Email"),
                     "status": account.get("Status"),
                 }
-                account_list.append(Account(**account_data))
-            except ValidationError as e:
-                print(
-                    f"Error creating Account object: {e.errors()}"
-                )  # Informative error message
+                for account in page.get("Accounts", [])
+            ),
+            strict=strict,
+        )
+
+    if show:
+        print_accounts(account_list)
+
+    return account_list
+
+
+def build_accounts(records, strict=False) -> List[Account]:
+    """Builds an Account per record, printing and skipping invalid ones.
+
+    Args:
+        records: Dicts of account_id, account_name, root_email and status,
+            from Organizations or the AccountCache.
+        strict: Fully validate every record instead of trusting it (see
+            Account.trusted).
+
+    Returns:
+        The Account objects of the valid records.
+    """
 
+    from pydantic import ValidationError
+    from .objects.classes import Account
+
+    construct = Account if strict else Account.trusted
+    accounts = []
+    for record in records:
+        try:
+            accounts.append(construct(**record))
+        except ValidationError as e:
+            print(f"Error creating Account object: {e.errors()}")
+        except ValueError as e:
+            print(f"Error creating Account object: {e}")
+    return accounts
+
+
+def print_accounts(account_list):
     # Print table only if there are accounts (avoid empty table output)
     if account_list:
         table = [["Account ID", "Root Email", "Account Name", "Account Status"]]
         table.extend(
             [
-                [acc.account_id, acc.root_email, acc.account_name, acc.status]
+                [acc.account_id, acc.root_email, acc.account_name, acc.status.value]
                 for acc in account_list
             ]
         )
-        print(tabulate(table, headers="firstrow", tablefmt="fancy_grid"))
+        print_table(table)
 
-    return account_list
+
+def get_account_directory(
+    aws_profile_name=AWS_PROFILE, refresh=False, show=False, strict=False
+) -> AccountDirectory:
+    """Returns the organization's accounts from memory, disk or Organizations.
+
+    The account list is served from the AccountCache while it is younger
+    than its TTL; otherwise, or with refresh, it is re-listed through
+    get_list_of_accounts and saved. If that fails, an expired copy is used
+    rather than aborting the run.
+
+    Args:
+        aws_profile_name: The AWS profile of the organization's payer.
+        refresh: Ignore the cached copy and re-list the accounts.
+        show: Print the accounts as a table.
+        strict: Fully validate every account (see get_list_of_accounts).
+
+    Returns:
+        An AccountDirectory of the organization's accounts.
+    """
+
+    cache = AccountCache(aws_profile_name)
+    records = None if refresh else cache.load()
+    if records is None:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            accounts = get_list_of_accounts(
+                get_org_client(aws_profile_name), strict=strict
+            )
+        except (BotoCoreError, ClientError) as e:
+            records = cache.load(allow_stale=True)
+            if records is None:
+                raise
+            print(f"Could not refresh the account list ({e}), using the cached copy")
+        else:
+            cache.save([account.model_dump(mode="json") for account in accounts])
+    if records is not None:
+        accounts = build_accounts(records, strict=strict)
+    if show:
+        print_accounts(accounts)
+    return AccountDirectory(accounts)
+
+
+def as_account_directory(account_list) -> AccountDirectory:
+    """Returns account_list as an AccountDirectory, indexing it if needed."""
+    if isinstance(account_list, AccountDirectory):
+        return account_list
+    return AccountDirectory(account_list)
+
+
+def iter_group_rows(groups, account_names, is_excluded=None):
+    """Yields the (name, dimension, amount, unit, excluded, period) of every
+    group.
+
+    Account names, "Name$" stripping and the exclusion test are looked up
+    once per distinct key and memoized, so each group only costs a few dict
+    lookups.
+
+    Args:
+        groups: An iterable of Cost Explorer billing groups.
+        account_names: A dict mapping account ids to account names.
+        is_excluded: A predicate on the second key (service or usage type)
+            for rows that are not billable; defaults to the exclusions of
+            rules.DEFAULT_RULES.
+
+    Yields:
+        One tuple per group, in input order, with the amount rounded to 3
+        digits, the dimension "Total" for single-key groups and the
+        (start, end) of the group's TimePeriod.
+    """
+
+    from .rules import default_rules
+
+    is_excluded = is_excluded or default_rules().is_excluded
+    names = {}
+    excluded = {}
+    for group in groups:
+        keys = group.get("Keys")
+        cost = group.get("Metrics").get("UnblendedCost", {})
+        name = names.get(keys[0])
+        if name is None:
+            name = account_names.get(keys[0], keys[0])
+            if name.startswith("Name$"):
+                name = name[5:]
+            names[keys[0]] = name
+        dimension = keys[1] if len(keys) > 1 else "Total"
+        skip = excluded.get(dimension)
+        if skip is None:
+            skip = excluded[dimension] = is_excluded(dimension)
+        amount = round(float(cost.get("Amount", 0.0)), 3)
+        period = group.get("TimePeriod", {})
+        yield name, dimension, amount, cost.get("Unit", ""), skip, (
+            period.get("Start", ""),
+            period.get("End", ""),
+        )
+
+
+@METRICS.timed("process_billing_results", rows=int)
+def stream_billing_results(groups, account_list, write) -> int:
+    """Processes billing results groups, passing each table row to write.
+
+    Each row ends with the start and end of its group's period, so the rows
+    of a range spanning several periods stay distinct. Rows with a zero
+    amount or an excluded service (see iter_group_rows) are dropped; only
+    one group is held at a time.
+
+    Args:
+        groups: An iterable of billing results groups, consumed as a stream
+            (see iter_cost_and_usage_groups).
+        account_list: An AccountDirectory (or a list of account objects)
+            for name lookup.
+        write: A callable receiving each row, e.g. a list's append or a
+            sinks.ReportOutput's.
+
+    Returns:
+        The number of rows written.
+    """
+
+    accounts = as_account_directory(account_list)
+    count = 0
+    for name, service, amount, unit, excluded, period in iter_group_rows(
+        groups, accounts.name_map()
+    ):
+        if amount != 0 and not excluded:
+            write([name, service, amount, unit, *period])
+            count += 1
+    return count
 
 
 def process_billing_results(groups, account_list) -> list:
     """Processes billing results groups and creates table data.
 
     Args:
-        groups: A list of billing results groups.
-        account_list: A list of account objects for name lookup.
+        groups: An iterable of billing results groups, consumed as a stream
+            (see iter_cost_and_usage_groups).
+        account_list: An AccountDirectory (or a list of account objects)
+            for name lookup.
 
     Returns:
         A list of lists representing the table data.
     """
 
     table = []
-    for group in groups:
-        name = accountid = group.get("Keys")[0]
-        account = find_account(account_list, "account_id", accountid)
-        if account:
-            name = getattr(account, "account_name")
-        if name.startswith("Name$"):
-            name = name[5:]
-
-        service = (
-            group.get("Keys", [])[1] if len(group.get("Keys")) > 1 else "Total"
-        )  # Handle optional service
-        amount = round(
-            float(group.get("Metrics").get("UnblendedCost", {}).get("Amount", 0.0)), 3
-        )
-        unit = group.get("Metrics").get("UnblendedCost", {}).get("Unit", "")
-        if amount != 0 and check_elements_not_in_string(
-            ["AWS-Out-Bytes", "DataTransfer"], service
-        ):
-            table.append([name, service, amount, unit])
+    stream_billing_results(groups, account_list, table.append)
     return table
 
 
+@METRICS.timed("process_billing_results_tags", rows=int)
+def stream_billing_results_tag_splits(
+    groups, account_list, writers, account_id=None, rules=None
+) -> int:
+    """Processes tag billing groups into one table per split, in one pass.
+
+    Rows end with their group's period start and end. Rows with a zero
+    amount or an excluded usage type (DataTransfer, AWS-Out-Bytes) are
+    summed per period and tag into trailing "AWS Data Transfer" rows, so
+    only those totals are held until the groups run out.
+    For an account split by the rules (see rules.DEFAULT_RULES) each tag is
+    classified once and a split named after a bucket only keeps that
+    bucket's tags; the "" split, and every split of an account that is not
+    split, keeps all tags. Without account_id, the split defining the
+    requested bucket names is applied.
+
+    Args:
+        groups: An iterable of billing results groups, consumed as a stream
+            (see iter_cost_and_usage_groups).
+        account_list: An AccountDirectory (or a list of account objects)
+            for name lookup.
+        writers: A dict mapping each split name to a callable receiving
+            the split's rows.
+        account_id: The account the groups were filtered on.
+        rules: A rules.ClassificationRules, default rules.default_rules().
+
+    Returns:
+        The number of rows written, over all splits.
+    """
+    from .rules import default_rules
+
+    rules = rules or default_rules()
+    accounts = as_account_directory(account_list)
+    classify = rules.classifier(account_id, tuple(writers))
+    buckets = {}
+    data_transfer = {split: {} for split in writers}
+    units = {split: None for split in writers}
+    count = 0
+    for name, usage, amount, unit, excluded, period in iter_group_rows(
+        groups, accounts.name_map(), rules.is_excluded
+    ):
+        if classify is not None and name not in buckets:
+            buckets[name] = classify(name)
+        for split, write in writers.items():
+            if classify is not None and split and buckets[name] != split:
+                continue
+            units[split] = unit
+            if amount != 0 and not excluded:
+                write(["Amazon Compute Cloud", name, usage, amount, unit, *period])
+                count += 1
+            else:
+                totals = data_transfer[split]
+                totals[period, name] = totals.get((period, name), 0.0) + amount
+
+    for split, write in writers.items():
+        for (period, name), total in data_transfer[split].items():
+            write(["AWS Data Transfer", name, "", total, units[split], *period])
+            count += 1
+    return count
+
+
+def process_billing_results_tag_splits(
+    groups, account_list, splits=("",), account_id=None, rules=None
+) -> dict:
+    """Processes tag billing groups into one table per split, in one pass
+    (see stream_billing_results_tag_splits).
+
+    Returns:
+        A dict mapping each split name to a list of lists representing the
+        table data.
+    """
+
+    tables = {split: [] for split in splits}
+    stream_billing_results_tag_splits(
+        groups,
+        account_list,
+        {split: table.append for split, table in tables.items()},
+        account_id=account_id,
+        rules=rules,
+    )
+    return tables
+
+
 def process_billing_results_tags(groups, account_list, **kwargs) -> list:
     """Processes billing results groups and creates table data.
 
+    A single split of process_billing_results_tag_splits: with btsc and an
+    account_id split by the rules, only the tags of the btsc bucket
+    ("personal" or "btsc") are kept.
+
     Args:
-        groups: A list of billing results groups.
-        account_list: A list of account objects for name lookup.
+        groups: An iterable of billing results groups, consumed as a stream
+            (see iter_cost_and_usage_groups).
+        account_list: An AccountDirectory (or a list of account objects)
+            for name lookup.
 
     Returns:
         A list of lists representing the table data.
     """
-    sum = 0
-    empty_list = []
-    btsc = None
-    if kwargs:
-        btsc = kwargs.get("btsc")
-    table = []
-    for group in groups:
-        name = accountid = group.get("Keys")[0]
-        account = find_account(account_list, "account_id", accountid)
-        if account:
-            name = getattr(account, "account_name")
-        if name.startswith("Name$"):
-            name = name[5:]
-        if btsc is None:
-            usage = (
-                group.get("Keys", [])[1] if len(group.get("Keys")) > 1 else "Total"
-            )  # Handle optional service
-            amount = round(
-                float(group.get("Metrics").get("UnblendedCost", {}).get("Amount", 0.0)),
-                3,
-            )
-            unit = group.get("Metrics").get("UnblendedCost", {}).get("Unit", "")
-            if amount != 0 and check_elements_not_in_string(
-                ["AWS-Out-Bytes", "DataTransfer"], usage
-            ):
-                table.append(["Amazon Compute Cloud", name, usage, amount, unit])
-            else:
-                empty_list.append((name, amount))
-        else:
-            if btsc == "personal":
-                if name in ["LN-BTSC-WEB1", "LN-BTSC-WEB2"]:
-                    usage = (
-                        group.get("Keys", [])[1]
-                        if len(group.get("Keys")) > 1
-                        else "Total"
-                    )  # Handle optional service
-                    amount = round(
-                        float(
-                            group.get("Metrics")
-                            .get("UnblendedCost", {})
-                            .get("Amount", 0.0)
-                        ),
-                        3,
-                    )
-                    unit = group.get("Metrics").get("UnblendedCost", {}).get("Unit", "")
-                    if amount != 0 and check_elements_not_in_string(
-                        ["AWS-Out-Bytes", "DataTransfer"], usage
-                    ):
-                        table.append(
-                            ["Amazon Compute Cloud", name, usage, amount, unit]
-                        )
-                    else:
-                        empty_list.append((name, amount))
-            if btsc == "btsc":
-                if name not in ["LN-BTSC-WEB1", "LN-BTSC-WEB2"]:
-                    usage = (
-                        group.get("Keys", [])[1]
-                        if len(group.get("Keys")) > 1
-                        else "Total"
-                    )  # Handle optional service
-                    amount = round(
-                        float(
-                            group.get("Metrics")
-                            .get("UnblendedCost", {})
-                            .get("Amount", 0.0)
-                        ),
-                        3,
-                    )
-                    unit = group.get("Metrics").get("UnblendedCost", {}).get("Unit", "")
-                    if amount != 0 and check_elements_not_in_string(
-                        ["AWS-Out-Bytes", "DataTransfer"], usage
-                    ):
-                        table.append(
-                            ["Amazon Compute Cloud", name, usage, amount, unit]
-                        )
-                    else:
-                        empty_list.append((name, amount))
-
-    result = sum_by_group(empty_list)
-    for item in result:
-        table.append(["AWS Data Transfer", item[0], "", item[1], unit])
-    return table
+
+    btsc = kwargs.get("btsc") or ""
+    return process_billing_results_tag_splits(
+        groups,
+        account_list,
+        splits=(btsc,),
+        account_id=kwargs.get("account_id"),
+        rules=kwargs.get("rules"),
+    )[btsc]
 
 
 def aws_billing_service(
@@ -280,10 +535,15 @@ def aws_billing_service(
     end_date: str,
     account_list: List,
     granularity: str = "MONTHLY",
+    store=None,
+    show: bool = True,
 ) -> None:
     """Fetches AWS billing cost data grouped by linked account and service."""
 
-    response = boto3_client.get_cost_and_usage(
+    groups = fetch_cost_groups(
+        boto3_client,
+        store,
+        service_report_id(),
         TimePeriod={"Start": start_date, "End": end_date},
         Granularity=granularity,
         Metrics=["UnblendedCost"],
@@ -301,12 +561,10 @@ def aws_billing_service(
         },
     )
 
-    table = process_billing_results(
-        response.get("ResultsByTime", [])[0].get("Groups", []), account_list
-    )
+    table = process_billing_results(groups, account_list)
 
-    if table:
-        print(tabulate(table, headers="firstrow", tablefmt="fancy_grid"))
+    if table and show:
+        print_table(table)
 
     return table
 
@@ -320,7 +578,8 @@ def aws_billing(
 ) -> None:
     """Fetches AWS billing cost data grouped by linked account and service."""
 
-    response = boto3_client.get_cost_and_usage(
+    groups = iter_cost_and_usage_groups(
+        boto3_client,
         TimePeriod={"Start": start_date, "End": end_date},
         Granularity=granularity,
         Metrics=["UnblendedCost"],
@@ -337,16 +596,146 @@ def aws_billing(
         },
     )
 
-    table = process_billing_results(
-        response.get("ResultsByTime", [])[0].get("Groups", []), account_list
-    )
+    table = process_billing_results(groups, account_list)
 
     if table:
-        print(tabulate(table, headers="firstrow", tablefmt="fancy_grid"))
+        print_table(table)
 
     return table
 
 
+def tally_groups(groups, account_totals, service_totals=None):
+    """Passes groups through while summing their raw amounts per period.
+
+    Args:
+        groups: An iterable of LINKED_ACCOUNT x SERVICE billing groups.
+        account_totals: A dict updated with
+            {(account_id, (start, end)): [amount, unit]}.
+        service_totals: An optional dict updated with
+            {(service, (start, end)): [amount, unit]}.
+
+    Yields:
+        The groups, unchanged.
+    """
+
+    for group in groups:
+        keys = group.get("Keys")
+        cost = group.get("Metrics").get("UnblendedCost", {})
+        amount = float(cost.get("Amount", 0.0))
+        unit = cost.get("Unit", "")
+        time_period = group.get("TimePeriod", {})
+        period = (time_period.get("Start", ""), time_period.get("End", ""))
+        total = account_totals.setdefault((keys[0], period), [0.0, unit])
+        total[0] += amount
+        if service_totals is not None and len(keys) > 1:
+            total = service_totals.setdefault((keys[1], period), [0.0, unit])
+            total[0] += amount
+        yield group
+
+
+def stream_service_report(
+    boto3_client: boto3.client,
+    start_date: str,
+    end_date: str,
+    account_list: List,
+    write,
+    granularity: str = "MONTHLY",
+    service_rollup: bool = False,
+    store=None,
+) -> tuple:
+    """Streams the per-service breakdown and derives per-account totals locally.
+
+    Issues the single LINKED_ACCOUNT x SERVICE query of aws_billing_service,
+    passes every breakdown row to write and sums every group per account
+    (and, with service_rollup, per service) in the same pass, instead of a
+    second LINKED_ACCOUNT-only query. Totals are kept per period, like the
+    breakdown rows, and end with the period's start and end. Account totals
+    include the DataTransfer services that the breakdown hides, as the
+    LINKED_ACCOUNT query does.
+
+    Returns:
+        An (account_table, service_rollup_table) tuple; the last one is
+        empty unless service_rollup is set.
+    """
+
+    account_totals = {}
+    service_totals = {} if service_rollup else None
+    groups = fetch_cost_groups(
+        boto3_client,
+        store,
+        service_report_id(),
+        TimePeriod={"Start": start_date, "End": end_date},
+        Granularity=granularity,
+        Metrics=["UnblendedCost"],
+        GroupBy=[
+            {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"},
+            {"Type": "DIMENSION", "Key": "SERVICE"},
+        ],
+        Filter={
+            "Not": {
+                "Dimensions": {
+                    "Key": "RECORD_TYPE",
+                    "Values": ["Tax", "Credit", "Refund", "Distributor Discount"],
+                }
+            },
+        },
+    )
+    stream_billing_results(
+        tally_groups(groups, account_totals, service_totals), account_list, write
+    )
+    accounts = as_account_directory(account_list)
+    account_table = [
+        [accounts.name_for(account_id), "Total", round(amount, 3), unit, *period]
+        for (account_id, period), (amount, unit) in account_totals.items()
+        if round(amount, 3) != 0
+    ]
+    service_rollup_table = [
+        [service, round(amount, 3), unit, *period]
+        for (service, period), (amount, unit) in (service_totals or {}).items()
+        if round(amount, 3) != 0
+    ]
+    return account_table, service_rollup_table
+
+
+def aws_billing_with_rollups(
+    boto3_client: boto3.client,
+    start_date: str,
+    end_date: str,
+    account_list: List,
+    granularity: str = "MONTHLY",
+    service_rollup: bool = False,
+    store=None,
+    show: bool = True,
+) -> tuple:
+    """Fetches the per-service breakdown and the per-account totals derived
+    from it (see stream_service_report).
+
+    Returns:
+        A (account_table, service_table, service_rollup_table) tuple; the
+        last one is empty unless service_rollup is set.
+    """
+
+    service_table = []
+    account_table, service_rollup_table = stream_service_report(
+        boto3_client,
+        start_date,
+        end_date,
+        account_list,
+        service_table.append,
+        granularity=granularity,
+        service_rollup=service_rollup,
+        store=store,
+    )
+
+    if account_table and show:
+        print_table(account_table)
+    if service_table and show:
+        print_table(service_table)
+
+    return account_table, service_table, service_rollup_table
+
+
+@METRICS.timed("get_cost_allocation_tags", rows=len)
 def get_cost_allocation_tags(
     boto3_client: boto3.client,
     start_date: str,  # format: yyyy-mm-dd
@@ -354,8 +743,13 @@ def get_cost_allocation_tags(
     tag_key: str,
     account_id: str,
 ):
+    """Returns every value of tag_key used by an account, following
+    NextPageToken until Cost Explorer has returned all pages.
+
+    Values are de-duplicated in first-seen order.
+    """
 
-    response = boto3_client.get_tags(
+    request = dict(
         TimePeriod={"Start": start_date, "End": end_date},
         TagKey=tag_key,
         Filter={
@@ -365,7 +759,61 @@ def get_cost_allocation_tags(
             }
         },
     )
-    return response.get("Tags", [])
+    tags = {}
+    while True:
+        response = boto3_client.get_tags(**request)
+        tags.update(dict.fromkeys(response.get("Tags", [])))
+        token = response.get("NextPageToken")
+        if not token:
+            return list(tags)
+        request["NextPageToken"] = token
+
+
+def chunked(values, size):
+    """Splits values into lists of at most size items; an empty input gives
+    a single empty chunk so the caller still issues one query."""
+    values = list(values)
+    return [values[i : i + size] for i in range(0, len(values), size)] or [values]
+
+
+def iter_tag_chunk_groups(
+    boto3_client, request_for_values, tag_values, chunk_size, max_workers
+):
+    """Runs one get_cost_and_usage query per chunk of tag values and merges
+    the groups.
+
+    The chunks are fetched in parallel with fan_out and yielded in chunk
+    order. tag_values are de-duplicated before chunking and every query is
+    grouped by the tag and filtered on its own chunk, so each group's tag
+    value belongs to exactly one chunk and the chunk results are disjoint.
+
+    Args:
+        boto3_client: A boto3 client for AWS Cost Explorer.
+        request_for_values: A callable returning the get_cost_and_usage
+            keyword arguments for a list of tag values.
+        tag_values: All the tag values to query.
+        chunk_size: The maximum number of tag values per query.
+        max_workers: The number of chunk queries run at once.
+
+    Yields:
+        The merged Cost Explorer groups.
+    """
+
+    chunks = chunked(dict.fromkeys(tag_values), chunk_size)
+    if len(chunks) == 1:
+        yield from iter_cost_and_usage_groups(
+            boto3_client, **request_for_values(chunks[0])
+        )
+        return
+    results = fan_out(
+        lambda chunk: list(
+            iter_cost_and_usage_groups(boto3_client, **request_for_values(chunk))
+        ),
+        chunks,
+        max_workers=max_workers,
+    )
+    for groups in results:
+        yield from groups
 
 
 def aws_billing_tags(
@@ -382,7 +830,8 @@ def aws_billing_tags(
 
     # still cannot read the correct services
 
-    response = boto3_client.get_cost_and_usage(
+    groups = iter_cost_and_usage_groups(
+        boto3_client,
         TimePeriod={"Start": start_date, "End": end_date},
         Granularity=granularity,
         Metrics=["UnblendedCost"],
@@ -420,36 +869,40 @@ def aws_billing_tags(
             ]
         },
     )
-    table = process_billing_results(
-        response.get("ResultsByTime", [])[0].get("Groups", []), account_list
-    )
+    table = process_billing_results(groups, account_list)
 
     if table:
-        print(tabulate(table, headers="firstrow", tablefmt="fancy_grid"))
+        print_table(table)
 
     return table
 
 
-def aws_billing_ec2_volume_snapshots(
-    boto3_client: boto3.client,
-    start_date: str,
-    end_date: str,
-    account_list: List,
-    account_id: str,
-    tag_key: str,
-    tagValue: List,
-    granularity: str = "MONTHLY",
-    **kwargs,
+def ec2_tag_request(
+    start_date,
+    end_date,
+    tag_key,
+    account_ids,
+    tag_values,
+    granularity="MONTHLY",
+    by_account=False,
 ):
-    """Fetches AWS billing cost data grouped by Tag and service."""
+    """Returns the get_cost_and_usage arguments of an EC2 usage-by-tag query.
 
-    # still cannot read the correct services
-    response = boto3_client.get_cost_and_usage(
+    The query is grouped by TAG x USAGE_TYPE, or LINKED_ACCOUNT x USAGE_TYPE
+    when by_account is set, and filtered on the EC2 services, the accounts
+    and the tag values.
+    """
+
+    return dict(
         TimePeriod={"Start": start_date, "End": end_date},
         Granularity=granularity,
         Metrics=["UnblendedCost"],
         GroupBy=[
-            {"Type": "TAG", "Key": tag_key},
+            (
+                {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"}
+                if by_account
+                else {"Type": "TAG", "Key": tag_key}
+            ),
             # {"Type": "DIMENSION", "Key": "SERVICE"},
             {"Type": "DIMENSION", "Key": "USAGE_TYPE"},
         ],
@@ -480,36 +933,160 @@ def aws_billing_ec2_volume_snapshots(
                 {
                     "Tags": {
                         "Key": tag_key,
-                        "Values": tagValue,
+                        "Values": list(tag_values),
                     },
                 },
                 {
                     "Dimensions": {
                         "Key": "LINKED_ACCOUNT",
-                        "Values": [account_id],
+                        "Values": list(account_ids),
                     },
                 },
             ]
         },
     )
-    if account_id == "943316794729":
-        btsc = kwargs.get("btsc")
-        table = process_billing_results_tags(
-            response.get("ResultsByTime", [])[0].get("Groups", []),
-            account_list,
-            btsc=btsc,
+
+
+def stream_ec2_volume_snapshot_splits(
+    boto3_client: boto3.client,
+    start_date: str,
+    end_date: str,
+    account_list: List,
+    account_id: str,
+    tag_key: str,
+    tagValue: List,
+    writers,
+    granularity: str = "MONTHLY",
+    store=None,
+    chunk_size: int = TAG_VALUES_PER_QUERY,
+    max_workers: int = TAG_CHUNK_WORKERS,
+    fetch=None,
+) -> int:
+    """Streams AWS billing cost data grouped by Tag and service, once for
+    every split.
+
+    tagValue is split into chunks of at most chunk_size values, one query
+    per chunk, run max_workers at a time; the merged groups are classified
+    into splits (see stream_billing_results_tag_splits) in a single pass.
+
+    Args:
+        writers: A dict mapping each split name to a callable receiving the
+            split's rows.
+        fetch: An optional callable returning the account's groups, used
+            instead of querying Cost Explorer (see planner.TagQueryPlan).
+
+    Returns:
+        The number of rows written, over all splits.
+    """
+
+    # still cannot read the correct services
+    def request_for_values(values):
+        return ec2_tag_request(
+            start_date, end_date, tag_key, [account_id], values, granularity
         )
-    else:
-        table = process_billing_results_tags(
-            response.get("ResultsByTime", [])[0].get("Groups", []),
-            account_list,
+
+    if fetch is None:
+        fetch = functools.partial(
+            iter_tag_chunk_groups,
+            boto3_client,
+            request_for_values,
+            tagValue,
+            chunk_size,
+            max_workers,
         )
-    if table:
-        print(tabulate(table, headers="firstrow", tablefmt="fancy_grid"))
+    groups = fetch_cost_groups(
+        boto3_client,
+        store,
+        tag_report_id(tag_key, account_id),
+        fetch=fetch,
+        **request_for_values([]),
+    )
+    return stream_billing_results_tag_splits(
+        groups, account_list, writers, account_id=account_id
+    )
 
-    return table
 
+def aws_billing_ec2_volume_snapshot_splits(
+    boto3_client: boto3.client,
+    start_date: str,
+    end_date: str,
+    account_list: List,
+    account_id: str,
+    tag_key: str,
+    tagValue: List,
+    splits=("",),
+    granularity: str = "MONTHLY",
+    show: bool = True,
+    store=None,
+    chunk_size: int = TAG_VALUES_PER_QUERY,
+    max_workers: int = TAG_CHUNK_WORKERS,
+) -> dict:
+    """Fetches AWS billing cost data grouped by Tag and service, once for
+    every split (see stream_ec2_volume_snapshot_splits).
+
+    Returns:
+        A dict mapping each split name to its table.
+    """
+
+    tables = {split: [] for split in splits}
+    stream_ec2_volume_snapshot_splits(
+        boto3_client,
+        start_date,
+        end_date,
+        account_list,
+        account_id,
+        tag_key,
+        tagValue,
+        {split: table.append for split, table in tables.items()},
+        granularity=granularity,
+        store=store,
+        chunk_size=chunk_size,
+        max_workers=max_workers,
+    )
+    if show:
+        for table in tables.values():
+            if table:
+                print_table(table)
+
+    return tables
+
+
+def aws_billing_ec2_volume_snapshots(
+    boto3_client: boto3.client,
+    start_date: str,
+    end_date: str,
+    account_list: List,
+    account_id: str,
+    tag_key: str,
+    tagValue: List,
+    granularity: str = "MONTHLY",
+    show: bool = True,
+    store=None,
+    **kwargs,
+):
+    """Fetches AWS billing cost data grouped by Tag and service.
+
+    The btsc keyword selects a single split (see
+    aws_billing_ec2_volume_snapshot_splits).
+    """
 
+    btsc = kwargs.get("btsc") or ""
+    return aws_billing_ec2_volume_snapshot_splits(
+        boto3_client,
+        start_date,
+        end_date,
+        account_list,
+        account_id,
+        tag_key,
+        tagValue,
+        splits=(btsc,),
+        granularity=granularity,
+        show=show,
+        store=store,
+    )[btsc]
+
+
+@METRICS.timed("tabulate_to_excel")
 def tabulate_to_excel(
     data,
     headers="firstrow",
@@ -520,6 +1097,9 @@ def tabulate_to_excel(
     """
     Exports a tabulate table (with headers in the first row or provided separately) to an Excel file.
 
+    Rows are streamed into a write-only workbook (see sinks.ExcelSink)
+    instead of being copied into a DataFrame first.
+
     Args:
         data: A list of lists representing the table data, with or without headers in the first row.
         filename: The output Excel file name (default: "output_table.xlsx").
@@ -530,18 +1110,567 @@ def tabulate_to_excel(
         None
     """
 
-    # Create DataFrame using tabulate
-    try:
-        df = pd.DataFrame(
-            data, columns=headers
-        )  # tabulate(data, headers=headers, tablefmt="plain"))
-    except ValueError as e:
-        print("Error:", e)
-    # Export DataFrame to Excel
-    df.to_excel(filename, sheet_name=sheet_name, index=index)
+    from .sinks import ExcelSink
+
+    rows = iter(data)
+    if headers == "firstrow":
+        headers = next(rows, [])
+    if index:
+        headers = ["", *headers]
+        rows = ([i, *row] for i, row in enumerate(rows))
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with ExcelSink(filename) as sink:
+        sink.write_sheet(sheet_name, headers, rows)
+
+
+def open_ce_client(
+    aws_profile_name=AWS_PROFILE,
+    no_cache=False,
+    refresh=False,
+    ce_rate=CE_REQUESTS_PER_SECOND,
+):
+    """Returns a rate-limited Cost Explorer client, wrapped in the response
+    cache unless no_cache is set, along with the cache (or None)."""
+
+    ce_client = ThrottledClient(get_ce_client(aws_profile_name), TokenBucket(ce_rate))
+    if no_cache:
+        return ce_client, None
+    cache = ResponseCache(namespace=aws_profile_name)
+    return CachingClient(ce_client, cache, refresh=refresh), cache
+
+
+def print_preview(title, headers, rows, total):
+    """Prints the first rows of a report in the fancy_grid format, followed
+    by how many rows were left out."""
+    from tabulate import tabulate
+
+    if not rows:
+        return
+    print(title)
+    print(tabulate(rows, headers=headers, tablefmt="fancy_grid"))
+    if total > len(rows):
+        print(f"... {total - len(rows)} more rows")
+
+
+def print_output_preview(output):
+    print_preview(output.name, output.headers, output.preview, output.rows)
+
+
+def run_service_report(
+    ce_client,
+    account_list,
+    str_date,
+    end_date,
+    entity,
+    output_dir="excel_output",
+    sink=None,
+    store=None,
+    preview_rows=PREVIEW_ROWS,
+    output_format="xlsx",
+):
+    """Streams the per-service report to Excel (or output_format) and
+    previews it.
+
+    With a sink, the account totals and the service breakdown are written
+    as "Accounts" and "Services" sheets of the sink's workbook; otherwise
+    the service breakdown goes to its own file in output_dir. Only the
+    per-account totals and preview_rows rows are held in memory.
+    """
+    from .sinks import ReportOutput
+
+    if sink is not None:
+        accounts_output = ReportOutput(
+            "Accounts", ACCOUNT_HEADERS, sink, preview_rows=preview_rows
+        )
+        services_output = ReportOutput(
+            "Services", SERVICE_HEADERS, sink, preview_rows=preview_rows
+        )
+    else:
+        accounts_output = None
+        services_output = ReportOutput(
+            f"{entity} services",
+            SERVICE_HEADERS,
+            path=os.path.join(output_dir, f"{end_date}_billing_services_{entity}"),
+            preview_rows=preview_rows,
+            output_format=output_format,
+        )
+    account_table, _ = stream_service_report(
+        ce_client,
+        str_date,
+        end_date,
+        account_list,
+        services_output.append,
+        store=store,
+    )
+    if accounts_output is not None:
+        for row in account_table:
+            accounts_output.append(row)
+    services_output.close()
+    print_preview(
+        f"{entity} accounts",
+        ACCOUNT_HEADERS,
+        account_table[:preview_rows],
+        len(account_table),
+    )
+    print_output_preview(services_output)
+
+
+def find_account_by_name(account_list, account_name):
+    """Returns the account named account_name, matched case-insensitively
+    if there is no exact match, or None."""
+    return account_list.by_name(account_name) or account_list.by_name(
+        account_name, case_sensitive=False
+    )
+
+
+def tag_report_name(account_name, split=""):
+    report_name = "".join(account_name).replace(" ", "_").lower()
+    return f"{report_name}-{split}" if split else report_name
+
+
+def tag_report_covered(store, tag_key, account_id, str_date, end_date):
+    """Returns whether an offline history store answers a tag report."""
+    return bool(
+        store is not None
+        and store.offline
+        and store.covering_granularity(
+            tag_report_id(tag_key, account_id), str_date, end_date
+        )
+    )
+
+
+def stream_tag_reports(
+    ce_client,
+    account_list,
+    str_date,
+    end_date,
+    account_id,
+    tag_key,
+    writers,
+    store=None,
+    tags=None,
+    fetch=None,
+):
+    """Discovers the tag values of an account and streams its EC2 usage by
+    tag, every split from the same Cost Explorer queries.
+
+    Tag discovery is skipped when an offline history store already covers
+    the report.
+
+    Args:
+        writers: A dict mapping each split name to a callable receiving the
+            split's rows.
+        tags: The account's tag values when already discovered.
+        fetch: An optional callable returning the account's groups (see
+            stream_ec2_volume_snapshot_splits).
+    """
+
+    if tags is not None:
+        pass
+    elif tag_report_covered(store, tag_key, account_id, str_date, end_date):
+        tags = []
+    else:
+        tags = get_cost_allocation_tags(
+            ce_client, str_date, end_date, tag_key, account_id
+        )
+    stream_ec2_volume_snapshot_splits(
+        ce_client,
+        str_date,
+        end_date,
+        account_list,
+        account_id,
+        tag_key,
+        tags,
+        writers,
+        store=store,
+        fetch=fetch,
+    )
+
+
+def open_tag_outputs(
+    account_name,
+    tag_key,
+    splits,
+    period,
+    output_dir,
+    sink=None,
+    preview_rows=PREVIEW_ROWS,
+    output_format="xlsx",
+):
+    """Opens one ReportOutput per split of an account's tag report, as
+    sheets of sink or as files of their own in output_dir.
+
+    Args:
+        period: The report's (str_date, end_date).
+    """
+    from .sinks import ReportOutput
+
+    outputs = {}
+    for split in dict.fromkeys(splits):
+        report_name = tag_report_name(account_name, split)
+        outputs[split] = ReportOutput(
+            report_name,
+            TAG_HEADERS,
+            sink,
+            path=os.path.join(
+                output_dir, f"{period[1]}_{report_name}_billing_tags_by_{tag_key}"
+            ),
+            preview_rows=preview_rows,
+            output_format=output_format,
+        )
+    return outputs
+
+
+def run_tag_report(
+    ce_client,
+    account_list,
+    str_date,
+    end_date,
+    account_name,
+    tag_key,
+    btsc="",
+    output_dir="excel_output",
+    store=None,
+    preview_rows=PREVIEW_ROWS,
+    output_format="xlsx",
+):
+    """Streams the EC2 usage-by-tag workbook of a single account."""
+
+    print(btsc)
+    account = find_account_by_name(account_list, account_name)
+    if account is None:
+        print(f"No account_id found for specified account {account_name}")
+        return
+    outputs = open_tag_outputs(
+        account_name,
+        tag_key,
+        (btsc,),
+        (str_date, end_date),
+        output_dir,
+        preview_rows=preview_rows,
+        output_format=output_format,
+    )
+    stream_tag_reports(
+        ce_client,
+        account_list,
+        str_date,
+        end_date,
+        account.account_id,
+        tag_key,
+        {split: output.append for split, output in outputs.items()},
+        store=store,
+    )
+    for output in outputs.values():
+        output.close()
+        print_output_preview(output)
+
+
+def report_snapshot(
+    ce_client,
+    account_list,
+    store,
+    str_date,
+    end_date,
+    account=None,
+    tag_key="Name",
+    refresh=False,
+):
+    """Returns the diff snapshot of the service report, or of an account's
+    tag report, for [str_date, end_date) (see diff.snapshot).
+
+    A saved snapshot is returned without any query unless refresh is set.
+    Otherwise the report is rebuilt through the history store, which reads
+    locally when it covers the period. Its snapshot is only saved when the
+    period is final by the response cache's rule: closed (see
+    response_cache.is_closed_period) and with no row the store holds for it
+    estimated, whether the rows were just fetched or read locally.
+    """
+    from .diff import snapshot
+
+    if account is None:
+        report = service_report_id()
+    else:
+        report = tag_report_id(tag_key, account.account_id)
+    if not refresh:
+        saved = store.load_snapshot(report, str_date, end_date)
+        if saved is not None:
+            return saved
+    rows = []
+    if account is None:
+        stream_service_report(
+            ce_client, str_date, end_date, account_list, rows.append, store=store
+        )
+        result = snapshot(rows)
+    else:
+        stream_tag_reports(
+            ce_client,
+            account_list,
+            str_date,
+            end_date,
+            account.account_id,
+            tag_key,
+            {"": rows.append},
+            store=store,
+        )
+        result = snapshot(rows, account.account_name)
+    period = {"TimePeriod": {"Start": str(str_date), "End": str(end_date)}}
+    if is_closed_period(period) and not store.has_estimates(report, str_date, end_date):
+        store.save_snapshot(report, str_date, end_date, result)
+    return result
+
+
+def sync_history(
+    ce_client,
+    account_list,
+    store,
+    since,
+    tag_reports=(),
+    restatement_days=RESTATEMENT_DAYS,
+):
+    """Fetches DAILY cost data after each report's stored watermark.
+
+    Every report is re-fetched from restatement_days before its watermark
+    (or from since when nothing is stored yet) up to today, so late
+    restatements by AWS are picked up while closed days are not
+    re-downloaded.
+
+    Args:
+        ce_client: A boto3 client for AWS Cost Explorer.
+        account_list: An AccountDirectory.
+        store: The CostHistoryStore to fill.
+        since: The first day to fetch for a report with no history.
+        tag_reports: (account_name, tag_key) pairs to sync besides the
+            service report.
+        restatement_days: Days before the watermark to fetch again.
+    """
+
+    start, end = store.sync_window(
+        service_report_id(), since, restatement_days=restatement_days
+    )
+    if start < end:
+        print(f"Syncing {service_report_id()} {start}..{end}")
+        aws_billing_service(
+            ce_client,
+            start,
+            end,
+            account_list,
+            granularity="DAILY",
+            store=store,
+            show=False,
+        )
+    for account_name, tag_key in tag_reports:
+        account = find_account_by_name(account_list, account_name)
+        if not account:
+            print(f"No account_id found for specified account {account_name}")
+            continue
+        report = tag_report_id(tag_key, account.account_id)
+        start, end = store.sync_window(report, since, restatement_days=restatement_days)
+        if start >= end:
+            continue
+        print(f"Syncing {report} {start}..{end}")
+        tags = get_cost_allocation_tags(
+            ce_client, start, end, tag_key, account.account_id
+        )
+        aws_billing_ec2_volume_snapshots(
+            ce_client,
+            start,
+            end,
+            account_list,
+            account.account_id,
+            tag_key,
+            tags,
+            granularity="DAILY",
+            show=False,
+            store=store,
+        )
+
+
+def plan_tag_jobs(
+    ce_client, store, str_date, end_date, reports, workers=4, coalesce=True
+):
+    """Discovers the tag values of a batch's tag reports and coalesces their
+    Cost Explorer queries across accounts (see planner.TagQueryPlan).
+
+    Reports answered by an offline history store are left out.
+
+    Args:
+        reports: A list of (tag_key, account_id) tuples.
+
+    Returns:
+        A (tags, fetches) tuple of dicts keyed by (tag_key, account_id):
+        the discovered tag values of every live report, and for the reports
+        of coalesced plans a callable returning the account's groups.
+    """
+    from .planner import plan_tag_queries
+
+    live = [
+        report
+        for report in dict.fromkeys(reports)
+        if not tag_report_covered(store, *report, str_date, end_date)
+    ]
+    discovered = fan_out(
+        lambda report: get_cost_allocation_tags(ce_client, str_date, end_date, *report),
+        live,
+        max_workers=workers,
+    )
+    tags = dict(zip(live, discovered))
+    if not coalesce:
+        return tags, {}
+
+    fetches = {}
+    plans = plan_tag_queries(
+        [(*report, values) for report, values in tags.items()], TAG_VALUES_PER_QUERY
+    )
+    for tag_key, plan in plans.items():
+        if len(plan.tags_by_account) > 1:
+            print(plan.summary())
+        if not plan.coalesced:
+            continue
+
+        def run_query(account_ids, tag_values, by_account, tag_key=tag_key):
+            return iter_cost_and_usage_groups(
+                ce_client,
+                **ec2_tag_request(
+                    str_date,
+                    end_date,
+                    tag_key,
+                    account_ids,
+                    tag_values,
+                    by_account=by_account,
+                ),
+            )
+
+        spools = plan.fetch(run_query, max_workers=workers)
+        for account_id, spool in spools.items():
+            fetches[(tag_key, account_id)] = functools.partial(iter, spool)
+    return tags, fetches
 
 
-@click.command()
+def run_batch(
+    spec,
+    profile,
+    options,
+    output_dir="excel_output",
+    workers=4,
+    ce_rate=CE_REQUESTS_PER_SECOND,
+    coalesce=True,
+):
+    """Runs the reports of one organization's batch job.
+
+    Args:
+        spec: The JobSpec to run.
+        profile: The AWS profile of the organization's payer.
+        options: The main command's options (dates, cache and account
+            flags).
+        output_dir: The directory receiving one folder per entity.
+        workers: The number of concurrent tag report queries.
+        ce_rate: Cost Explorer requests per second for this organization.
+        coalesce: Whether tag reports on several accounts may share Cost
+            Explorer queries (see plan_tag_jobs).
+    """
+    from .sinks import open_sink
+
+    str_date = options["str_date"]
+    end_date = options["end_date"]
+
+    account_list = get_account_directory(
+        profile,
+        refresh=options["refresh_accounts"],
+        show=options["show_accounts"],
+        strict=options["strict_accounts"],
+    )
+    ce_client, cache = open_ce_client(
+        profile,
+        no_cache=options["no_cache"],
+        refresh=options["refresh"],
+        ce_rate=ce_rate,
+    )
+    store = CostHistoryStore(payer=profile, offline=options["offline"])
+    preview_rows = options["preview"]
+    output_format = options["output_format"]
+    tag_jobs = []
+    sinks = {}
+    for entity in spec.entities:
+        entity_dir = os.path.join(output_dir, entity.output_directory)
+        os.makedirs(entity_dir, exist_ok=True)
+        if entity.single_workbook:
+            sinks[entity.name] = open_sink(
+                os.path.join(entity_dir, f"{end_date}_billing_{entity.name}"),
+                output_format,
+            )
+        if entity.service_report:
+            run_service_report(
+                ce_client,
+                account_list,
+                str_date,
+                end_date,
+                entity.name,
+                entity_dir,
+                sink=sinks.get(entity.name),
+                store=store,
+                preview_rows=preview_rows,
+                output_format=output_format,
+            )
+        for tag_report in entity.tag_reports:
+            account = find_account_by_name(account_list, tag_report.account_name)
+            if account is None:
+                print(
+                    f"No account_id found for specified account {tag_report.account_name}"
+                )
+                continue
+            outputs = open_tag_outputs(
+                tag_report.account_name,
+                tag_report.tag_key,
+                tag_report.btsc,
+                (str_date, end_date),
+                entity_dir,
+                sink=sinks.get(entity.name),
+                preview_rows=preview_rows,
+                output_format=output_format,
+            )
+            tag_jobs.append((tag_report, account, outputs))
+
+    tags, fetches = plan_tag_jobs(
+        ce_client,
+        store,
+        str_date,
+        end_date,
+        [
+            (tag_report.tag_key, account.account_id)
+            for tag_report, account, _ in tag_jobs
+        ],
+        workers,
+        coalesce,
+    )
+    fan_out(
+        lambda job: stream_tag_reports(
+            ce_client,
+            account_list,
+            str_date,
+            end_date,
+            job[1].account_id,
+            job[0].tag_key,
+            {split: output.append for split, output in job[2].items()},
+            store=store,
+            tags=tags.get((job[0].tag_key, job[1].account_id)),
+            fetch=fetches.get((job[0].tag_key, job[1].account_id)),
+        ),
+        tag_jobs,
+        max_workers=workers,
+    )
+    for _, _, outputs in tag_jobs:
+        for output in outputs.values():
+            output.close()
+            print_output_preview(output)
+    for sink in sinks.values():
+        sink.close()
+    store.close()
+    if cache:
+        print(f"{profile or 'default'}: {cache.summary()}")
+        cache.close()
+
+
+@click.group(invoke_without_command=True)
 @click.option(
     "--str_date",
     is_flag=False,
@@ -561,61 +1690,426 @@ def tabulate_to_excel(
 @click.option("--tag_key", is_flag=False, default="Name", help="Tag Key")
 @click.option("--entity", is_flag=False, default="offshore", help="Entity Name")
 @click.option("--btsc", is_flag=False, default="", help="Personal or Bentham")
-def main(str_date, end_date, tag_billing_required, account_name, tag_key, entity, btsc):
-    ACCOUNT_LIST = get_list_of_accounts(get_org_client())
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Bypass the Cost Explorer cache"
+)
+@click.option(
+    "--refresh", is_flag=True, help="Re-query Cost Explorer and update the cache"
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Serve reports from the local history store when it covers them",
+)
+@click.option(
+    "--refresh_accounts",
+    is_flag=True,
+    help="Re-list the organization's accounts instead of using the cached copy",
+)
+@click.option("--show_accounts", is_flag=True, help="Print the account table")
+@click.option(
+    "--strict_accounts",
+    is_flag=True,
+    help="Fully validate account records (emails included)",
+)
+@click.option(
+    "--profile",
+    is_flag=False,
+    default=AWS_PROFILE,
+    help="AWS profile of the payer organization (default: AWS_PROFILE)",
+)
+@click.option(
+    "--preview",
+    is_flag=False,
+    default=PREVIEW_ROWS,
+    help="Rows of each report to print (0 prints none)",
+)
+@click.option(
+    "--output-format",
+    "output_format",
+    type=click.Choice(["xlsx", "csv", "jsonl", "parquet"]),
+    default="xlsx",
+    help="Report file format (parquet needs pyarrow)",
+)
+@click.option(
+    "--metrics-out",
+    "metrics_out",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write run metrics to this file (Prometheus textfile if it ends in .prom, JSON otherwise)",
+)
+@click.pass_context
+def main(
+    ctx,
+    str_date,
+    end_date,
+    tag_billing_required,
+    account_name,
+    tag_key,
+    entity,
+    btsc,
+    no_cache,
+    refresh,
+    offline,
+    refresh_accounts,
+    show_accounts,
+    strict_accounts,
+    profile,
+    preview,
+    output_format,
+    metrics_out,
+):
+    if output_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise click.BadParameter(
+            "parquet output needs pyarrow (pip install pyarrow)",
+            param_hint="--output-format",
+        )
+    if metrics_out:
+        started = time.perf_counter()
+
+        def write_metrics():
+            METRICS.add_stage("run", time.perf_counter() - started)
+            CLIENTS.report(METRICS)
+            METRICS.write(metrics_out)
+
+        ctx.call_on_close(write_metrics)
+    ctx.obj = {
+        "profile": profile,
+        "str_date": str_date,
+        "end_date": end_date,
+        "no_cache": no_cache,
+        "refresh": refresh,
+        "offline": offline,
+        "refresh_accounts": refresh_accounts,
+        "show_accounts": show_accounts,
+        "strict_accounts": strict_accounts,
+        "preview": preview,
+        "output_format": output_format,
+    }
+    if ctx.invoked_subcommand is not None:
+        return
+
+    ACCOUNT_LIST = get_account_directory(
+        profile, refresh=refresh_accounts, show=show_accounts, strict=strict_accounts
+    )
+    ce_client, cache = open_ce_client(profile, no_cache=no_cache, refresh=refresh)
+    store = CostHistoryStore(payer=profile, offline=offline)
 
     if tag_billing_required in ("True", "true"):
-        account = find_account(ACCOUNT_LIST, "account_name", account_name)
-        account_name = "".join(account_name).replace(" ", "_").lower()
-        account_id = None
-        if account:
-            account_id = account.account_id
-            print(f"account_id: {account_id}")
-        if account_id:
-            tags = get_cost_allocation_tags(
-                get_ce_client(), str_date, end_date, tag_key, account_id
-            )
-            print(btsc)
-            if btsc:
-                billing_table = aws_billing_ec2_volume_snapshots(
-                    get_ce_client(),
-                    str_date,
-                    end_date,
-                    ACCOUNT_LIST,
-                    account_id,
-                    tag_key,
-                    tags,
-                    btsc=btsc,
-                )
-                account_name = f"{account_name}-{btsc}"
-            else:
-                billing_table = aws_billing_ec2_volume_snapshots(
-                    get_ce_client(),
-                    str_date,
-                    end_date,
-                    ACCOUNT_LIST,
-                    account_id,
-                    tag_key,
-                    tags,
-                )
-            tabulate_to_excel(
-                data=billing_table,
-                headers=["Service", "Tag", "Usage Type", "Charges", "Currency"],
-                filename=f"excel_output/{end_date}_{account_name}_billing_tags_by_{tag_key}.xlsx",
-            )
-        else:
-            print(f"No account_id found for specified account {account_name}")
+        run_tag_report(
+            ce_client,
+            ACCOUNT_LIST,
+            str_date,
+            end_date,
+            account_name,
+            tag_key,
+            btsc,
+            store=store,
+            preview_rows=preview,
+            output_format=output_format,
+        )
     if tag_billing_required in ("false", "False"):
-        aws_billing(get_ce_client(), str_date, end_date, ACCOUNT_LIST)
-        billing_table = aws_billing_service(
-            get_ce_client(), str_date, end_date, ACCOUNT_LIST
+        run_service_report(
+            ce_client,
+            ACCOUNT_LIST,
+            str_date,
+            end_date,
+            entity,
+            store=store,
+            preview_rows=preview,
+            output_format=output_format,
         )
+    store.close()
+    if cache:
+        print(cache.summary())
+        cache.close()
+
+
+@main.command()
+@click.argument(
+    "job_files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--output_dir", is_flag=False, default="excel_output", help="Output Directory"
+)
+@click.option(
+    "--workers", is_flag=False, default=4, help="Concurrent tag report queries"
+)
+@click.option(
+    "--ce_rate",
+    is_flag=False,
+    default=CE_REQUESTS_PER_SECOND,
+    help="Cost Explorer requests per second, per organization",
+)
+@click.option(
+    "--profiles",
+    is_flag=False,
+    default=None,
+    help="Comma-separated AWS profiles, one per JOB_FILE (default: each job's profile)",
+)
+@click.option(
+    "--no_coalesce",
+    is_flag=True,
+    help="Query every tag report's account separately",
+)
+@click.pass_context
+def batch(ctx, job_files, output_dir, workers, ce_rate, profiles, no_coalesce):
+    """Runs every report listed in JOB_FILES in a single process.
+
+    Each job file is one payer organization; several are run concurrently,
+    each with its own session, rate limiter and cache namespace.
+    """
+    from .objects.jobs import load_job_spec
+
+    specs = [load_job_spec(job_file) for job_file in job_files]
+    if profiles:
+        profiles = [profile.strip() for profile in profiles.split(",")]
+        if len(profiles) != len(specs):
+            raise click.BadParameter(
+                f"{len(profiles)} profiles for {len(specs)} job files",
+                param_hint="--profiles",
+            )
+    else:
+        profiles = [spec.profile or ctx.obj["profile"] for spec in specs]
+    # Every tag job fans its chunk queries out again.
+    CLIENTS.reserve(workers * TAG_CHUNK_WORKERS)
+    fan_out(
+        lambda job: run_batch(
+            job[0],
+            job[1],
+            ctx.obj,
+            output_dir=output_dir,
+            workers=workers,
+            ce_rate=ce_rate,
+            coalesce=not no_coalesce,
+        ),
+        list(zip(specs, profiles)),
+        max_workers=len(specs),
+    )
+
+
+@main.command()
+@click.option(
+    "--job_file",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Batch job file whose tag reports are synced too",
+)
+@click.option(
+    "--since",
+    is_flag=False,
+    default=LAST_MONTH.strftime("%Y-%m-01"),
+    help="First day to fetch for reports with no history",
+)
+@click.option(
+    "--restatement_days",
+    is_flag=False,
+    default=RESTATEMENT_DAYS,
+    help="Days before the watermark to fetch again",
+)
+@click.pass_context
+def sync(ctx, job_file, since, restatement_days):
+    """Fetches new DAILY cost data into the local history store."""
+
+    profile = ctx.obj["profile"]
+    tag_reports = []
+    if job_file:
+        from .objects.jobs import load_job_spec
+
+        spec = load_job_spec(job_file)
+        profile = spec.profile or profile
+        tag_reports = [
+            (tag_report.account_name, tag_report.tag_key)
+            for entity in spec.entities
+            for tag_report in entity.tag_reports
+        ]
+    account_list = get_account_directory(
+        profile,
+        refresh=ctx.obj["refresh_accounts"],
+        show=ctx.obj["show_accounts"],
+        strict=ctx.obj["strict_accounts"],
+    )
+    ce_client, cache = open_ce_client(
+        profile, no_cache=ctx.obj["no_cache"], refresh=ctx.obj["refresh"]
+    )
+    store = CostHistoryStore(payer=profile)
+    sync_history(
+        ce_client,
+        account_list,
+        store,
+        since,
+        tag_reports=list(dict.fromkeys(tag_reports)),
+        restatement_days=restatement_days,
+    )
+    store.close()
+    if cache:
+        print(cache.summary())
+        cache.close()
+
 
-        tabulate_to_excel(
-            data=billing_table,
-            headers=["Account Name", "AWS Service", "Charges", "Currency"],
-            filename=f"excel_output/{end_date}_billing_services_{entity}.xlsx",
+@main.command()
+@click.option(
+    "--group_by",
+    is_flag=False,
+    default="account,service",
+    help="Comma-separated dimensions: account, service, usage_type, tag:<key>",
+)
+@click.option(
+    "--filter",
+    "filters",
+    multiple=True,
+    help="dimension=value[,value...] to keep, e.g. account=123456789012",
+)
+@click.pass_context
+def cube(ctx, group_by, filters):
+    """Answers a grouping of stored cost data locally, from the cost cube."""
+    from .cube import ACCOUNT, CostCube, CubeMiss
+
+    profile = ctx.obj["profile"]
+    group_by = [dimension.strip() for dimension in group_by.split(",")]
+    wanted = {}
+    for value in filters:
+        dimension, _, values = value.partition("=")
+        wanted.setdefault(dimension.strip(), []).extend(values.split(","))
+    account_list = get_account_directory(
+        profile,
+        refresh=ctx.obj["refresh_accounts"],
+        show=ctx.obj["show_accounts"],
+        strict=ctx.obj["strict_accounts"],
+    )
+    if ACCOUNT in wanted:
+        wanted[ACCOUNT] = [
+            getattr(account_list.by_name(value), "account_id", value)
+            for value in wanted[ACCOUNT]
+        ]
+    store = CostHistoryStore(payer=profile, offline=True)
+    try:
+        rows = CostCube(store).query(
+            group_by, ctx.obj["str_date"], ctx.obj["end_date"], wanted
         )
+    except CubeMiss as e:
+        print(f"{e}; run sync to fetch it")
+        return
+    finally:
+        store.close()
+    if ACCOUNT in group_by:
+        column = group_by.index(ACCOUNT)
+        for row in rows:
+            row[column] = account_list.name_for(row[column])
+    print_table([[*group_by, "Charges", "Currency"], *rows])
+
+
+@main.command()
+@click.option(
+    "--previous_start",
+    default=None,
+    help="Start of the period to compare with (default: the preceding period)",
+)
+@click.option("--previous_end", default=None, help="End of the period to compare with")
+@click.option(
+    "--account_name",
+    default=None,
+    help="Compare this account's tag report instead of the service report",
+)
+@click.option("--tag_key", default="Name", help="Tag key of the tag report")
+@click.option("--top", default=10, help="Number of top movers to print")
+@click.option(
+    "--output_dir", default="excel_output", help="Directory of the delta report"
+)
+@click.pass_context
+def diff(ctx, previous_start, previous_end, account_name, tag_key, top, output_dir):
+    """Compares a report with the previous period and lists the top movers.
+
+    Each period's report is snapshotted in the history store, so periods
+    already compared (or synced) are not fetched again; only a missing
+    period is queried. --refresh rebuilds both from Cost Explorer.
+    """
+    from .diff import DIFF_HEADERS, diff_snapshots, previous_period, top_movers
+    from .sinks import ReportOutput
+
+    profile = ctx.obj["profile"]
+    str_date, end_date = str(ctx.obj["str_date"]), str(ctx.obj["end_date"])
+    if previous_start is None or previous_end is None:
+        previous_start, previous_end = previous_period(str_date, end_date)
+    account_list = get_account_directory(
+        profile,
+        refresh=ctx.obj["refresh_accounts"],
+        show=ctx.obj["show_accounts"],
+        strict=ctx.obj["strict_accounts"],
+    )
+    account = None
+    if account_name:
+        account = find_account_by_name(account_list, account_name)
+        if account is None:
+            print(f"No account_id found for specified account {account_name}")
+            return
+    ce_client, cache = open_ce_client(
+        profile, no_cache=ctx.obj["no_cache"], refresh=ctx.obj["refresh"]
+    )
+    store = CostHistoryStore(payer=profile, offline=not ctx.obj["refresh"])
+    try:
+        previous, current = [
+            report_snapshot(
+                ce_client,
+                account_list,
+                store,
+                start,
+                end,
+                account=account,
+                tag_key=tag_key,
+                refresh=ctx.obj["refresh"],
+            )
+            for start, end in (
+                (previous_start, previous_end),
+                (str_date, end_date),
+            )
+        ]
+    finally:
+        store.close()
+        if cache:
+            print(cache.summary())
+            cache.close()
+
+    rows = diff_snapshots(previous, current)
+    name = tag_report_name(account_name) if account_name else "services"
+    output = ReportOutput(
+        f"diff {name}",
+        DIFF_HEADERS,
+        path=os.path.join(output_dir, f"{end_date}_billing_diff_{name}"),
+        output_format=ctx.obj["output_format"],
+    )
+    for row in rows:
+        output.append(row)
+    output.close()
+    before = sum(amount for amount, _ in previous.values())
+    after = sum(amount for amount, _ in current.values())
+    print(
+        f"{previous_start}..{previous_end}: {before:,.2f}, "
+        f"{str_date}..{end_date}: {after:,.2f}, change {after - before:+,.2f} "
+        f"({len(rows)} changed lines)"
+    )
+    movers = top_movers(rows, top)
+    if movers:
+        print_table([DIFF_HEADERS, *movers])
+
+
+@main.command()
+@click.option("--refresh", is_flag=True, help="Re-list the accounts from Organizations")
+@click.option("--quiet", is_flag=True, help="Do not print the account table")
+@click.option(
+    "--profile", default=None, help="AWS profile (default: the main --profile)"
+)
+@click.option(
+    "--strict", is_flag=True, help="Fully validate account records (emails included)"
+)
+@click.pass_context
+def accounts(ctx, refresh, quiet, profile, strict):
+    """Prints the organization's accounts, refreshing the cached copy if asked."""
+
+    account_list = get_account_directory(
+        profile or ctx.obj["profile"], refresh=refresh, show=not quiet, strict=strict
+    )
+    print(f"{len(account_list)} accounts")
 
 
 if __name__ == "__main__":
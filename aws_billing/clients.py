@@ -0,0 +1,138 @@
+import threading
+
+from .metrics import METRICS, instrument
+
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 60  # seconds; large Cost Explorer pages are slow to build
+MAX_ATTEMPTS = 5  # botocore's attempts, for services it retries itself
+MAX_POOL_CONNECTIONS = 10  # botocore's default
+# Services whose calls go through throttle.ThrottledClient, which owns their
+# retries and client-side rate limiting; botocore makes a single attempt.
+SELF_RETRIED_SERVICES = ("ce",)
+
+
+class ClientRegistry:
+    """Process-wide cache of boto3 sessions and clients.
+
+    A session is created once per profile, so SSO credentials are resolved
+    once, and a client once per (profile, service, region), so its
+    connection pool is reused by every report and thread. Clients use
+    botocore's standard retry mode, without its client-side rate limiter,
+    and explicit timeouts, with a pool large enough for the configured
+    concurrency (see reserve). Services in SELF_RETRIED_SERVICES get a
+    single attempt, so retries are not stacked on ThrottledClient's. Every
+    client is instrumented (see metrics.instrument).
+    """
+
+    def __init__(
+        self,
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        max_attempts=MAX_ATTEMPTS,
+    ):
+        self.max_pool_connections = max_pool_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._clients = {}
+
+    def reserve(self, workers):
+        """Sizes the pools of clients created from now on for workers
+        concurrent calls, counting every nested fan-out; clients already
+        created keep their pool."""
+        with self._lock:
+            self.max_pool_connections = max(self.max_pool_connections, workers)
+
+    def config(self, service=None):
+        from botocore.config import Config
+
+        if service in SELF_RETRIED_SERVICES:
+            max_attempts = 1
+        else:
+            max_attempts = self.max_attempts
+        return Config(
+            retries={"mode": "standard", "max_attempts": max_attempts},
+            max_pool_connections=self.max_pool_connections,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+    def session(self, profile=None):
+        with self._lock:
+            return self._session(profile)
+
+    def _session(self, profile):
+        import boto3
+
+        session = self._sessions.get(profile)
+        if session is None:
+            session = boto3.Session(profile_name=profile)
+            self._sessions[profile] = session
+        return session
+
+    def client(self, service, profile=None, region=None):
+        """Returns the shared client of service for profile and region
+        (default: the profile's region), creating it on first use."""
+
+        key = (profile, service, region)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # boto3 sessions are not thread-safe, so clients are built
+                # under the lock.
+                client = self._session(profile).client(
+                    service, region_name=region, config=self.config(service)
+                )
+                self._clients[key] = instrument(client)
+            return client
+
+    def connection_stats(self):
+        """Returns {(profile, service, region): (connections, requests)}:
+        the HTTP connections each client opened and the requests it sent
+        over them, from its urllib3 pools."""
+
+        with self._lock:
+            clients = dict(self._clients)
+        return {key: _pool_counts(client) for key, client in clients.items()}
+
+    def reuse_ratio(self):
+        """Returns the share of requests sent over an already open
+        connection, or None before any request."""
+        stats = self.connection_stats().values()
+        connections = sum(created for created, _ in stats)
+        requests = sum(sent for _, sent in stats)
+        return 1 - connections / requests if requests else None
+
+    def report(self, metrics=METRICS):
+        """Records the connection counts of every client in metrics."""
+        for (profile, service, _), (created, sent) in self.connection_stats().items():
+            metrics.add_connections(service, profile, created, sent)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._sessions.clear()
+
+
+def _pool_counts(client):
+    # botocore keeps its urllib3 PoolManager (and one per proxy) on the
+    # client's endpoint; urllib3 pools count num_connections/num_requests.
+    http_session = getattr(getattr(client, "_endpoint", None), "http_session", None)
+    managers = [getattr(http_session, "_manager", None)]
+    managers += list(getattr(http_session, "_proxy_managers", {}).values())
+    connections = requests = 0
+    for manager in managers:
+        if manager is None:
+            continue
+        for pool_key in list(manager.pools.keys()):
+            pool = manager.pools.get(pool_key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests += pool.num_requests
+    return connections, requests
+
+
+CLIENTS = ClientRegistry()
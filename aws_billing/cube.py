@@ -0,0 +1,233 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from .history import service_report_id
+
+ACCOUNT = "account"
+SERVICE = "service"
+USAGE_TYPE = "usage_type"
+SERVICE_GRAIN = (ACCOUNT, SERVICE)
+
+
+class CubeMiss(LookupError):
+    """Raised when no stored grain answers a query; the data must be fetched."""
+
+
+def tag_dimension(tag_key):
+    return f"tag:{tag_key}"
+
+
+class _View:
+    """The DAILY facts of one grain, with memoized cumulative rollups.
+
+    A rollup over some dimensions holds one row per distinct combination of
+    their values (and unit) and the running sum of its amounts per day, so
+    the total over any [start, end) is one subtraction per row.
+    """
+
+    def __init__(self, dimensions, reports):
+        self.dimensions = dimensions
+        self.reports = reports  # {report: (constant values, key dimensions)}
+        self.coverage = {}  # {report: DAILY (start, end) intervals}
+        self._frame = None
+        self._rollups = {}
+
+    def covers(self, start, end, accounts=None):
+        """Whether [start, end) is held for accounts (default: all of them).
+
+        Only the reports that can hold rows of the accounts are checked, so
+        a report of another account missing these dates does not matter;
+        when no report holds the accounts, the view does not cover them.
+        """
+
+        relevant = []
+        for report, intervals in self.coverage.items():
+            account_id = self.reports[report][0].get(ACCOUNT)
+            if accounts is None or account_id is None or account_id in accounts:
+                relevant.append(intervals)
+        return bool(relevant) and all(
+            any(s <= start and end <= e for s, e in intervals) for intervals in relevant
+        )
+
+    def load(self, store):
+        frames = []
+        for report, (constants, key_dimensions) in self.reports.items():
+            frame = pd.DataFrame(
+                list(store.iter_rows(report)),
+                columns=["day", *key_dimensions, "amount", "unit"],
+            )
+            if key_dimensions[0].startswith("tag:"):
+                tags = frame[key_dimensions[0]]
+                frame[key_dimensions[0]] = tags.map(
+                    {tag: tag.split("$", 1)[-1] for tag in tags.unique()}
+                )
+            for dimension, value in constants.items():
+                frame[dimension] = value
+            frames.append(frame)
+        frame = pd.concat(frames, ignore_index=True)
+        codes, days = pd.factorize(frame["day"])
+        dates = pd.to_datetime(days)
+        self.day0 = dates.min().date() if len(dates) else datetime.date.min
+        offsets = np.asarray((dates - pd.Timestamp(self.day0)).days)
+        frame["day"] = offsets[codes] if len(codes) else codes
+        self.days = int(frame["day"].max()) + 1 if len(frame) else 0
+        self._frame = frame
+
+    def day_index(self, date):
+        days = (datetime.date.fromisoformat(str(date)) - self.day0).days
+        return min(max(days, 0), self.days)
+
+    def rollup(self, dimensions):
+        """Returns the memoized rollup of the view over dimensions.
+
+        The rollup is a (codes, uniques, cumulative) tuple: codes[i] holds
+        the value codes of cell i for each of dimensions and the unit,
+        uniques the values of each column, and cumulative[i, d] the amount
+        of cell i over the first d days.
+        """
+
+        rollup = self._rollups.get(dimensions)
+        if rollup is None:
+            frame = self._frame
+            columns = [*dimensions, "unit"]
+            factorized = [
+                pd.factorize(frame[column], use_na_sentinel=False) for column in columns
+            ]
+            row_codes = np.column_stack([codes for codes, _ in factorized])
+            codes, cell = np.unique(row_codes, axis=0, return_inverse=True)
+            cumulative = np.zeros((len(codes), self.days + 1))
+            np.add.at(
+                cumulative,
+                (cell.ravel(), frame["day"].to_numpy() + 1),
+                frame["amount"].to_numpy(),
+            )
+            rollup = (
+                codes,
+                [list(uniques) for _, uniques in factorized],
+                np.cumsum(cumulative, axis=1),
+            )
+            self._rollups[dimensions] = rollup
+        return rollup
+
+
+class CostCube:
+    """Local cost cube over the grains held in a CostHistoryStore.
+
+    Cost Explorer groups by at most two dimensions per query, so the store
+    holds several grains: account x service x day (the service report) and,
+    per tag key, account x tag x usage type x day (the EC2 tag reports). The
+    tag grains only hold the EC2 costs of the discovered tag values, so a
+    query on accounts and services is answered from the service grain alone,
+    and any other from the smallest tag grain that has all its dimensions;
+    either way the grain must cover the query's dates. Any grouping, filter
+    or date subrange of a stored grain is computed locally. A query no grain
+    answers raises CubeMiss.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._views = {}
+        self._results = {}
+        for report, intervals in store.coverage().items():
+            daily = [(s, e) for g, s, e in intervals if g == "DAILY"]
+            if not daily:
+                continue  # MONTHLY rows cannot answer day ranges
+            if report == service_report_id():
+                view = self._view(SERVICE_GRAIN)
+                view.reports[report] = ({}, SERVICE_GRAIN)
+            else:
+                _, tag_key, account_id = report.split(":", 2)
+                tag = tag_dimension(tag_key)
+                view = self._view((ACCOUNT, tag, USAGE_TYPE))
+                view.reports[report] = ({ACCOUNT: account_id}, (tag, USAGE_TYPE))
+            view.coverage[report] = daily
+
+    def _view(self, dimensions):
+        return self._views.setdefault(dimensions, _View(dimensions, {}))
+
+    def dimensions(self):
+        """Returns the dimension tuples of the stored grains."""
+        return list(self._views)
+
+    def query(self, group_by, start, end, filters=None):
+        """Sums the cost over [start, end) grouped by group_by.
+
+        Args:
+            group_by: Dimension names, e.g. ("account",) or
+                ("account", "tag:Name").
+            start: The first day (yyyy-mm-dd).
+            end: The day after the last one.
+            filters: An optional {dimension: values} dict of the values to
+                keep.
+
+        Returns:
+            A list of [*group_by values, amount, unit] rows, largest first,
+            with amounts rounded to 3 digits and zero rows dropped.
+
+        Raises:
+            CubeMiss: No stored grain has these dimensions over these dates.
+        """
+
+        filters = {
+            dimension: frozenset(values)
+            for dimension, values in (filters or {}).items()
+        }
+        key = (tuple(group_by), str(start), str(end), frozenset(filters.items()))
+        if key in self._results:
+            return self._results[key]
+        needed = set(group_by) | set(filters)
+        views = [
+            view
+            for dimensions, view in self._views.items()
+            if needed <= set(dimensions)
+        ]
+        if needed <= set(SERVICE_GRAIN):
+            # Tag grains hold the EC2 costs of tagged values, not totals.
+            views = [view for view in views if view.dimensions == SERVICE_GRAIN]
+        candidates = [
+            view
+            for view in views
+            if view.covers(str(start), str(end), filters.get(ACCOUNT))
+        ]
+        if not candidates:
+            raise CubeMiss(f"No stored grain has {sorted(needed)} for {start}..{end}")
+        view = min(candidates, key=lambda view: len(view.dimensions))
+        if view._frame is None:
+            view.load(self.store)
+        dimensions = tuple(sorted(needed))
+        codes, uniques, cumulative = view.rollup(dimensions)
+        amounts = (
+            cumulative[:, view.day_index(end)] - cumulative[:, view.day_index(start)]
+        )
+        selected = np.ones(len(codes), dtype=bool)
+        for dimension, values in filters.items():
+            column = dimensions.index(dimension)
+            allowed = [
+                code for code, value in enumerate(uniques[column]) if value in values
+            ]
+            selected &= np.isin(codes[:, column], allowed)
+        columns = [dimensions.index(dimension) for dimension in group_by]
+        columns.append(len(dimensions))  # unit
+        keys, amounts = codes[selected][:, columns], amounts[selected]
+        if len(group_by) < len(dimensions):
+            sizes = [len(uniques[column]) for column in columns]
+            linear, inverse = np.unique(
+                np.ravel_multi_index(keys.T, sizes), return_inverse=True
+            )
+            keys = np.column_stack(np.unravel_index(linear, sizes))
+            amounts = np.bincount(inverse, amounts, minlength=len(linear))
+        amounts = np.round(amounts, 3)
+        order = np.argsort(-amounts, kind="stable")
+        order = order[amounts[order] != 0]
+        values = [
+            np.asarray(uniques[column], dtype=object)[keys[order, j]].tolist()
+            for j, column in enumerate(columns)
+        ]
+        rows = [
+            [*row[:-1], amount, row[-1]]
+            for *row, amount in zip(*values, amounts[order].tolist())
+        ]
+        self._results[key] = rows
+        return rows
@@ -0,0 +1,98 @@
+import datetime
+import heapq
+
+DIFF_HEADERS = [
+    "Account Name",
+    "Service / Usage Type",
+    "Tag",
+    "Previous",
+    "Current",
+    "Change",
+    "Change %",
+    "Currency",
+]
+
+
+def previous_period(start, end):
+    """Returns the period of the same length just before [start, end).
+
+    A range of whole calendar months maps to the same number of months
+    before it, e.g. 2024-03-01..2024-04-01 to 2024-02-01..2024-03-01;
+    any other range is shifted back by its length in days.
+    """
+
+    start = datetime.date.fromisoformat(str(start))
+    end = datetime.date.fromisoformat(str(end))
+    if start.day == 1 and end.day == 1:
+        months = (end.year - start.year) * 12 + end.month - start.month
+        index = start.year * 12 + start.month - 1 - months
+        return datetime.date(index // 12, index % 12 + 1, 1).isoformat(), (
+            start.isoformat()
+        )
+    return (start - (end - start)).isoformat(), start.isoformat()
+
+
+def snapshot(rows, account_name=None):
+    """Keys report rows by (account, item, tag) and sums their amounts.
+
+    Args:
+        rows: Rows of process_billing_results ([Account Name, AWS Service,
+            Charges, Currency, Period Start, Period End]) or, with
+            account_name, of process_billing_results_tags ([Service, Tag,
+            Usage Type, Charges, Currency, Period Start, Period End]), whose
+            rows without a usage type are keyed by their service. The
+            periods of a range are summed.
+        account_name: The account of tag report rows.
+
+    Returns:
+        A dict mapping (account, item, tag) keys to (amount, unit) tuples.
+    """
+
+    totals = {}
+    for row in rows:
+        if account_name is None:
+            account, item, amount, unit = row[:4]
+            tag = ""
+        else:
+            service, tag, usage_type, amount, unit = row[:5]
+            account, item = account_name, usage_type or service
+        key = (account, item, tag or "")
+        previous = totals.get(key)
+        totals[key] = (float(amount) + (previous[0] if previous else 0.0), unit)
+    return totals
+
+
+def diff_snapshots(previous, current):
+    """Joins two snapshots on their keys and returns the changes.
+
+    The current snapshot is probed against the previous one's hash table,
+    then the keys only found in the previous one are appended, so the join
+    is linear in the number of keys.
+
+    Returns:
+        DIFF_HEADERS rows: current keys first, in their order, then the
+        keys that disappeared; unchanged keys are left out. Change % is
+        None for new keys.
+    """
+
+    rows = []
+    for key, (amount, unit) in current.items():
+        before, before_unit = previous.get(key, (0.0, unit))
+        if round(amount - before, 3):
+            rows.append(_diff_row(key, before, amount, unit or before_unit))
+    for key, (before, unit) in previous.items():
+        if key not in current and round(before, 3):
+            rows.append(_diff_row(key, before, 0.0, unit))
+    return rows
+
+
+def _diff_row(key, before, after, unit):
+    change = after - before
+    percent = round(change / abs(before) * 100, 1) if before else None
+    return [*key, round(before, 3), round(after, 3), round(change, 3), percent, unit]
+
+
+def top_movers(rows, count=10):
+    """Returns the count diff rows with the largest absolute change,
+    largest first."""
+    return heapq.nlargest(count, rows, key=lambda row: abs(row[5]))
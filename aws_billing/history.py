@@ -0,0 +1,426 @@
+import datetime
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+
+from .response_cache import CACHE_DIR
+
+RESTATEMENT_DAYS = 3
+SPOOL_BATCH_ROWS = 1000
+
+
+def service_report_id():
+    return "service"
+
+
+def tag_report_id(tag_key, account_id):
+    return f"tags:{tag_key}:{account_id}"
+
+
+def merge_intervals(intervals):
+    """Merges [start, end) date string intervals that touch or overlap."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _next_month(month):
+    """Returns the first day of the month after a "YYYY-MM" month."""
+    year, number = map(int, month.split("-"))
+    return datetime.date(year + number // 12, number % 12 + 1, 1).isoformat()
+
+
+def _month_start(today=None):
+    """Returns the first day of today's month; earlier periods are closed."""
+    return (today or datetime.date.today()).replace(day=1).isoformat()
+
+
+def _unspool(spool):
+    while True:
+        try:
+            yield from pickle.load(spool)
+        except EOFError:
+            return
+
+
+class Spool:
+    """An append-only sequence kept in a temporary file in batches of
+    batch_size items, so memory does not grow with its length.
+
+    The file is only created once a batch fills up. Appends are thread-safe;
+    iterating yields the items in append order.
+    """
+
+    def __init__(self, batch_size=SPOOL_BATCH_ROWS):
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._batch = []
+
+    def append(self, item):
+        with self._lock:
+            self._batch.append(item)
+            if len(self._batch) == self.batch_size:
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile()
+                pickle.dump(self._batch, self._file)
+                self._batch = []
+
+    def __iter__(self):
+        if self._file is not None:
+            self._file.seek(0)
+            yield from _unspool(self._file)
+        yield from self._batch
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CostHistoryStore:
+    """Local SQLite history of raw Cost Explorer groups.
+
+    Groups are stored per payer (profile), report and period with indexes on
+    period, first key (account or tag) and second key (service or usage
+    type). Each write replaces the rows of its report and granularity inside
+    the written range and records the range as covered, so a report for any
+    covered range can be answered offline. Rows keep Cost Explorer's
+    Estimated flag; estimated rows of a closed month no longer count as
+    covered, so they are fetched again. With ``offline`` set, callers read
+    from the store whenever it covers a request.
+    """
+
+    def __init__(self, path=None, payer=None, offline=False):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, "history.sqlite3")
+        self.path = path
+        self.payer = payer or "default"
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cost_groups (
+                    payer TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    granularity TEXT NOT NULL,
+                    period_start TEXT NOT NULL,
+                    period_end TEXT NOT NULL,
+                    key1 TEXT NOT NULL,
+                    key2 TEXT,
+                    amount REAL NOT NULL,
+                    unit TEXT NOT NULL,
+                    estimated INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS cost_groups_period
+                    ON cost_groups (payer, report, granularity, period_start);
+                CREATE INDEX IF NOT EXISTS cost_groups_key1
+                    ON cost_groups (payer, report, key1);
+                CREATE INDEX IF NOT EXISTS cost_groups_key2
+                    ON cost_groups (payer, report, key2);
+                CREATE TABLE IF NOT EXISTS coverage (
+                    payer TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    granularity TEXT NOT NULL,
+                    start TEXT NOT NULL,
+                    end TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    payer TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    period_start TEXT NOT NULL,
+                    period_end TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    unit TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS snapshots_period
+                    ON snapshots (payer, report, period_start, period_end);
+                CREATE TABLE IF NOT EXISTS snapshot_periods (
+                    payer TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    period_start TEXT NOT NULL,
+                    period_end TEXT NOT NULL,
+                    PRIMARY KEY (payer, report, period_start, period_end)
+                );
+                """)
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(cost_groups)")
+            ]
+            if "estimated" not in columns:
+                # Stores created before the flag was kept: their rows are
+                # taken as final, like the responses they came from.
+                self._conn.execute(
+                    "ALTER TABLE cost_groups"
+                    " ADD COLUMN estimated INTEGER NOT NULL DEFAULT 0"
+                )
+
+    def close(self):
+        self._conn.close()
+
+    def record(self, report, granularity, start, end, groups):
+        """Passes groups through and stores them once they are exhausted.
+
+        Rows are spooled (see Spool) while the groups pass, so memory does
+        not grow with the stream, then written in one transaction after the
+        last group, replacing whatever the store held for the report and
+        granularity in [start, end). A partially consumed stream writes
+        nothing.
+
+        Yields:
+            The groups, unchanged.
+        """
+
+        spool = Spool()
+        try:
+            for group in groups:
+                keys = group.get("Keys")
+                cost = group.get("Metrics").get("UnblendedCost", {})
+                period = group.get("TimePeriod", {})
+                spool.append(
+                    (
+                        self.payer,
+                        report,
+                        granularity,
+                        period.get("Start", str(start)),
+                        period.get("End", str(end)),
+                        keys[0],
+                        keys[1] if len(keys) > 1 else None,
+                        float(cost.get("Amount", 0.0)),
+                        cost.get("Unit", ""),
+                        bool(group.get("Estimated")),
+                    )
+                )
+                yield group
+            self.write(report, granularity, start, end, iter(spool))
+        finally:
+            spool.close()
+
+    def write(self, report, granularity, start, end, rows):
+        start, end = str(start), str(end)
+        scope = (self.payer, report, granularity)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM cost_groups WHERE payer = ? AND report = ?"
+                " AND granularity = ? AND period_start >= ? AND period_end <= ?",
+                (*scope, start, end),
+            )
+            self._conn.executemany(
+                "INSERT INTO cost_groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            intervals = self._conn.execute(
+                "SELECT start, end FROM coverage WHERE payer = ? AND report = ?"
+                " AND granularity = ?",
+                scope,
+            ).fetchall()
+            self._conn.execute(
+                "DELETE FROM coverage WHERE payer = ? AND report = ?"
+                " AND granularity = ?",
+                scope,
+            )
+            self._conn.executemany(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                [
+                    (*scope, s, e)
+                    for s, e in merge_intervals([*intervals, (start, end)])
+                ],
+            )
+
+    def covering_granularity(self, report, start, end):
+        """Returns the granularity whose stored rows span [start, end), if any.
+
+        DAILY rows can answer any range; MONTHLY rows only ranges made of
+        whole stored months. Rows of a closed month that were still
+        estimated when fetched do not count, so the range is fetched again.
+        """
+
+        start, end = str(start), str(end)
+        with self._lock:
+            intervals = self._conn.execute(
+                "SELECT granularity, start, end FROM coverage"
+                " WHERE payer = ? AND report = ?",
+                (self.payer, report),
+            ).fetchall()
+        for granularity in ("DAILY", "MONTHLY"):
+            for s, e in [(s, e) for g, s, e in intervals if g == granularity]:
+                if s <= start and end <= e:
+                    if self._closed_estimates(report, granularity, start, end):
+                        continue
+                    if granularity == "DAILY" or self._month_aligned(
+                        report, start, end
+                    ):
+                        return granularity
+        return None
+
+    def has_estimates(self, report, start, end):
+        """True if any stored row of report in [start, end) was still
+        estimated when it was fetched."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM cost_groups WHERE payer = ? AND report = ?"
+                " AND estimated AND period_start >= ? AND period_end <= ? LIMIT 1",
+                (self.payer, report, str(start), str(end)),
+            ).fetchone()
+        return row is not None
+
+    def _closed_estimates(self, report, granularity, start, end, today=None):
+        """Returns the start of the first estimated row of a closed month
+        in [start, end), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(period_start) FROM cost_groups WHERE payer = ?"
+                " AND report = ? AND granularity = ? AND estimated"
+                " AND period_start >= ? AND period_end <= ? AND period_end <= ?",
+                (self.payer, report, granularity, start, end, _month_start(today)),
+            ).fetchone()
+        return row[0]
+
+    def _month_aligned(self, report, start, end):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM cost_groups WHERE payer = ? AND report = ?"
+                " AND granularity = 'MONTHLY' AND period_start < ? AND period_end > ?"
+                " AND (period_start < ? OR period_end > ?)",
+                (self.payer, report, end, start, start, end),
+            ).fetchone()
+        return row[0] == 0
+
+    def coverage(self):
+        """Returns {report: [(granularity, start, end), ...]} for the payer."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT report, granularity, start, end FROM coverage"
+                " WHERE payer = ? ORDER BY report, start",
+                (self.payer,),
+            ).fetchall()
+        reports = {}
+        for report, granularity, start, end in rows:
+            reports.setdefault(report, []).append((granularity, start, end))
+        return reports
+
+    def watermark(self, report, granularity="DAILY"):
+        """Returns the end of the latest stored range, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(end) FROM coverage WHERE payer = ? AND report = ?"
+                " AND granularity = ?",
+                (self.payer, report, granularity),
+            ).fetchone()
+        return row[0]
+
+    def iter_groups(self, report, start, end, granularity=None):
+        """Yields stored groups summed per calendar month of [start, end),
+        shaped like the groups of a MONTHLY Cost Explorer query, month by
+        month and in first-seen order within a month; a group is Estimated
+        if any of its rows was."""
+
+        start, end = str(start), str(end)
+        granularity = granularity or self.covering_granularity(report, start, end)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT substr(period_start, 1, 7), key1, key2, SUM(amount), unit,"
+                " MAX(estimated) FROM cost_groups"
+                " WHERE payer = ? AND report = ? AND granularity = ?"
+                " AND period_start >= ? AND period_end <= ?"
+                " GROUP BY 1, key1, key2, unit ORDER BY 1, MIN(rowid)",
+                (self.payer, report, granularity, start, end),
+            ).fetchall()
+        for month, key1, key2, amount, unit, estimated in rows:
+            yield {
+                "Keys": [key1] if key2 is None else [key1, key2],
+                "Metrics": {"UnblendedCost": {"Amount": repr(amount), "Unit": unit}},
+                "TimePeriod": {
+                    "Start": max(start, f"{month}-01"),
+                    "End": min(end, _next_month(month)),
+                },
+                "Estimated": bool(estimated),
+            }
+
+    def iter_rows(self, report, granularity="DAILY"):
+        """Yields the stored (period_start, key1, key2, amount, unit) rows of
+        a report, in insertion order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT period_start, key1, key2, amount, unit FROM cost_groups"
+                " WHERE payer = ? AND report = ? AND granularity = ? ORDER BY rowid",
+                (self.payer, report, granularity),
+            ).fetchall()
+        yield from rows
+
+    def save_snapshot(self, report, start, end, snapshot):
+        """Replaces the stored snapshot of a report for [start, end).
+
+        Args:
+            snapshot: A dict mapping (account, item, tag) keys to
+                (amount, unit) tuples (see diff.snapshot).
+        """
+
+        scope = (self.payer, report, str(start), str(end))
+        where = "WHERE payer = ? AND report = ? AND period_start = ? AND period_end = ?"
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM snapshots {where}", scope)
+            self._conn.execute(f"DELETE FROM snapshot_periods {where}", scope)
+            self._conn.executemany(
+                "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (*scope, *key, amount, unit)
+                    for key, (amount, unit) in snapshot.items()
+                ),
+            )
+            self._conn.execute(
+                "INSERT INTO snapshot_periods VALUES (?, ?, ?, ?)", scope
+            )
+
+    def load_snapshot(self, report, start, end):
+        """Returns the stored snapshot of a report for [start, end), or None
+        if it was never saved."""
+
+        scope = (self.payer, report, str(start), str(end))
+        where = "WHERE payer = ? AND report = ? AND period_start = ? AND period_end = ?"
+        with self._lock:
+            if not self._conn.execute(
+                f"SELECT 1 FROM snapshot_periods {where}", scope
+            ).fetchone():
+                return None
+            rows = self._conn.execute(
+                f"SELECT account, item, tag, amount, unit FROM snapshots {where}"
+                " ORDER BY rowid",
+                scope,
+            ).fetchall()
+        return {
+            (account, item, tag): (amount, unit)
+            for account, item, tag, amount, unit in rows
+        }
+
+    def sync_window(self, report, since, today=None, restatement_days=RESTATEMENT_DAYS):
+        """Returns the (start, end) DAILY range a sync of report should fetch.
+
+        Starts restatement_days before the stored watermark, or at since if
+        nothing is stored yet, and ends today (Cost Explorer's End is
+        exclusive, so today's partial day is not fetched). Estimated rows
+        of closed months are always restated, however old.
+        """
+
+        today = today or datetime.date.today()
+        watermark = self.watermark(report)
+        if watermark is None:
+            start = datetime.date.fromisoformat(str(since))
+        else:
+            start = datetime.date.fromisoformat(watermark) - datetime.timedelta(
+                days=restatement_days
+            )
+            start = max(start, datetime.date.fromisoformat(str(since)))
+            estimated = self._closed_estimates(report, "DAILY", "", watermark, today)
+            if estimated is not None:
+                start = min(start, datetime.date.fromisoformat(estimated))
+        return start.isoformat(), today.isoformat()
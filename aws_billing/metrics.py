@@ -0,0 +1,310 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+CE_COST_PER_REQUEST = 0.01  # USD per Cost Explorer API request
+PREFIX = "aws_billing"
+
+
+class Metrics:
+    """Thread-safe counters for one run of the reports.
+
+    Stages record their call count, wall time and rows. A stage's time
+    excludes the stages nested in it on the same thread, so streamed
+    reports split into fetch, process and write time. AWS API calls are
+    counted per service and operation from botocore's event hooks (see
+    instrument), along with retries, throttles and errors. Cost Explorer
+    requests that reach AWS are billed at CE_COST_PER_REQUEST each.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "rows": 0})
+        self.api = defaultdict(
+            lambda: {
+                "calls": 0,
+                "seconds": 0.0,
+                "retries": 0,
+                "throttles": 0,
+                "errors": 0,
+            }
+        )
+        self.connections = {}
+        self._local = threading.local()
+
+    def _frames(self):
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def exclude(self, seconds):
+        """Takes seconds spent in a nested stage off the time of the timed
+        stage running on this thread, if any."""
+        frames = self._frames()
+        if frames:
+            frames[-1] += seconds
+
+    def add_stage(self, stage, seconds, rows=0, calls=1):
+        with self._lock:
+            entry = self.stages[stage]
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+
+    def add_rows(self, stage, rows):
+        self.add_stage(stage, 0.0, rows=rows, calls=0)
+
+    def add_api(self, service, operation, **counts):
+        with self._lock:
+            entry = self.api[(service, operation)]
+            for name, value in counts.items():
+                entry[name] += value
+
+    def add_connections(self, service, profile, connections, requests):
+        """Records the HTTP connections opened and requests sent by the
+        client of service for profile (see clients.ClientRegistry.report)."""
+        with self._lock:
+            self.connections[(service, profile or "default")] = {
+                "connections": connections,
+                "requests": requests,
+                "reuse_ratio": (
+                    round(1 - connections / requests, 3) if requests else None
+                ),
+            }
+
+    def timed(self, stage, rows=None):
+        """Decorates a function so each call is recorded as stage, minus
+        the time of the stages nested in it (see exclude).
+
+        Args:
+            stage: The stage name.
+            rows: An optional callable returning the number of rows of the
+                function's result.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                frames = self._frames()
+                frames.append(0.0)
+                started = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    nested = frames.pop()
+                    self.exclude(elapsed)
+                self.add_stage(
+                    stage,
+                    elapsed - nested,
+                    rows(result) if rows and result is not None else 0,
+                )
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def timed_iter(self, stage, iterable):
+        """Yields the items of iterable, recording the time spent waiting
+        for them, and their count, as stage once it is exhausted or closed.
+
+        The wait is measured on the consuming thread and excluded from the
+        stage consuming the items, e.g. fetching Cost Explorer pages from a
+        processor.
+        """
+
+        iterator = iter(iterable)
+        seconds = 0.0
+        count = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = time.perf_counter() - started
+                    seconds += elapsed
+                    self.exclude(elapsed)
+                count += 1
+                yield item
+        finally:
+            self.add_stage(stage, seconds, rows=count)
+
+    def ce_billed_requests(self):
+        with self._lock:
+            return sum(
+                entry["calls"] - entry["errors"]
+                for (service, _), entry in self.api.items()
+                if service == "ce"
+            )
+
+    def to_dict(self):
+        billed = self.ce_billed_requests()
+        with self._lock:
+            return {
+                "stages": {stage: dict(entry) for stage, entry in self.stages.items()},
+                "api": {
+                    f"{service}.{operation}": dict(entry)
+                    for (service, operation), entry in self.api.items()
+                },
+                "connections": {
+                    f"{service}:{profile}": dict(entry)
+                    for (service, profile), entry in self.connections.items()
+                },
+                "cost_explorer": {
+                    "billed_requests": billed,
+                    "estimated_cost_usd": round(billed * CE_COST_PER_REQUEST, 2),
+                },
+            }
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format, for
+        node_exporter's textfile collector."""
+
+        data = self.to_dict()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{_escape(label)}"' for key, label in labels.items()
+                )
+                if label_text:
+                    label_text = f"{{{label_text}}}"
+                lines.append(f"{PREFIX}_{name}{label_text} {value}")
+
+        stages = data["stages"].items()
+        family(
+            "stage_calls_total",
+            "counter",
+            "Calls per stage.",
+            [({"stage": s}, e["calls"]) for s, e in stages],
+        )
+        family(
+            "stage_seconds_total",
+            "counter",
+            "Wall time per stage.",
+            [({"stage": s}, e["seconds"]) for s, e in stages],
+        )
+        family(
+            "stage_rows_total",
+            "counter",
+            "Rows produced per stage.",
+            [({"stage": s}, e["rows"]) for s, e in stages],
+        )
+        api = [
+            ({"service": key.split(".")[0], "operation": key.split(".")[1]}, entry)
+            for key, entry in data["api"].items()
+        ]
+        for counter, help_text in (
+            ("calls", "AWS API calls (pages)."),
+            ("seconds", "Time spent in AWS API calls."),
+            ("retries", "AWS API retries."),
+            ("throttles", "AWS API throttling errors."),
+            ("errors", "AWS API calls that failed."),
+        ):
+            family(
+                f"api_{counter}_total",
+                "counter",
+                help_text,
+                [(labels, entry[counter]) for labels, entry in api],
+            )
+        connections = [
+            (
+                dict(zip(("service", "profile"), key.split(":", 1))),
+                entry,
+            )
+            for key, entry in data["connections"].items()
+        ]
+        family(
+            "http_connections_total",
+            "counter",
+            "HTTP connections opened per AWS client.",
+            [(labels, entry["connections"]) for labels, entry in connections],
+        )
+        family(
+            "http_requests_total",
+            "counter",
+            "HTTP requests sent per AWS client.",
+            [(labels, entry["requests"]) for labels, entry in connections],
+        )
+        family(
+            "ce_billed_requests",
+            "gauge",
+            "Cost Explorer requests billed by AWS.",
+            [({}, data["cost_explorer"]["billed_requests"])],
+        )
+        family(
+            "ce_estimated_cost_dollars",
+            "gauge",
+            "Estimated Cost Explorer API charge.",
+            [({}, data["cost_explorer"]["estimated_cost_usd"])],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the metrics to path, in the Prometheus text format when it
+        ends in .prom and as JSON otherwise."""
+
+        if path.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + "\n"
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as metrics_file:
+            metrics_file.write(text)
+        os.replace(temporary, path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics()
+
+
+def instrument(client, metrics=METRICS):
+    """Registers botocore event hooks counting every call made by client.
+
+    Calls are timed from before-call to after-call; retries are taken from
+    the response's RetryAttempts, and error responses are counted as
+    errors, and as throttles for throttling error codes.
+
+    Returns:
+        The client, for chaining.
+    """
+
+    from .throttle import THROTTLING_ERROR_CODES
+
+    service = client.meta.service_model.service_name
+    event_service = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+
+    def before_call(model, context, **kwargs):
+        context["metrics_started"] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        started = context.pop("metrics_started", None)
+        error_code = parsed.get("Error", {}).get("Code")
+        metrics.add_api(
+            service,
+            model.name,
+            calls=1,
+            seconds=time.perf_counter() - started if started else 0.0,
+            retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+            errors=int(http_response.status_code >= 400),
+            throttles=int(error_code in THROTTLING_ERROR_CODES),
+        )
+
+    events.register(f"before-call.{event_service}", before_call)
+    events.register(f"after-call.{event_service}", after_call)
+    return client
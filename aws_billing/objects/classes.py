@@ -2,6 +2,8 @@ from typing import Tuple
 from pydantic import BaseModel, EmailStr
 from enum import Enum
 
+from .directory import AccountDirectory, find_account
+
 
 class StatusEnum(Enum):
     active = "ACTIVE"
@@ -15,9 +17,17 @@ class Account(BaseModel):
     root_email: EmailStr
     status: StatusEnum
 
+    @classmethod
+    def trusted(cls, account_id, account_name, root_email, status):
+        """Builds an Account without validation, for data that comes straight
+        from the Organizations API (or our cache of it).
 
-def find_account(account_list, attribute, value):
-    for account in account_list:
-        if getattr(account, attribute) == value:
-            return account
-    return None
+        Skips pydantic validation and the email-validator check, which
+        dominate construction cost; only the status is coerced to StatusEnum.
+        """
+        return cls.model_construct(
+            account_id=account_id,
+            account_name=account_name,
+            root_email=root_email,
+            status=StatusEnum(status),
+        )
@@ -0,0 +1,66 @@
+class AccountDirectory:
+    """Hash index over a list of accounts.
+
+    Built once from get_list_of_accounts, it answers lookups by account id,
+    by exact account name and by case-insensitive account name in O(1)
+    instead of scanning the whole list for every Cost Explorer group.
+    """
+
+    def __init__(self, accounts=()):
+        self._accounts = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_folded_name = {}
+        for account in accounts:
+            self.add(account)
+
+    def add(self, account):
+        self._accounts.append(account)
+        # first match wins, as with the linear find_account scan
+        self._by_id.setdefault(account.account_id, account)
+        self._by_name.setdefault(account.account_name, account)
+        self._by_folded_name.setdefault(account.account_name.casefold(), account)
+
+    def __iter__(self):
+        return iter(self._accounts)
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def by_id(self, account_id):
+        return self._by_id.get(account_id)
+
+    def by_name(self, account_name, case_sensitive=True):
+        if case_sensitive:
+            return self._by_name.get(account_name)
+        return self._by_folded_name.get(account_name.casefold())
+
+    def find(self, attribute, value):
+        if attribute == "account_id":
+            return self.by_id(value)
+        if attribute == "account_name":
+            return self.by_name(value)
+        return find_account(self._accounts, attribute, value)
+
+    def name_map(self):
+        """Returns a {account_id: account_name} dict for bulk lookups."""
+        return {
+            account_id: account.account_name
+            for account_id, account in self._by_id.items()
+        }
+
+    def name_for(self, account_id):
+        """Returns the account name for an id, or the id itself if unknown."""
+        account = self._by_id.get(account_id)
+        if account:
+            return account.account_name
+        return account_id
+
+
+def find_account(account_list, attribute, value):
+    if isinstance(account_list, AccountDirectory):
+        return account_list.find(attribute, value)
+    for account in account_list:
+        if getattr(account, attribute) == value:
+            return account
+    return None
@@ -0,0 +1,40 @@
+import json
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class TagReportJob(BaseModel):
+    account_name: str
+    tag_key: str = "Name"
+    btsc: List[str] = [""]
+
+
+class EntityJob(BaseModel):
+    name: str
+    directory: Optional[str] = None
+    service_report: bool = True
+    single_workbook: bool = False
+    tag_reports: List[TagReportJob] = []
+
+    @property
+    def output_directory(self):
+        return self.directory or self.name
+
+
+class JobSpec(BaseModel):
+    profile: Optional[str] = None
+    entities: List[EntityJob]
+
+
+def load_job_spec(path) -> JobSpec:
+    """Reads and validates a JSON batch job file.
+
+    Args:
+        path: Path to the job file.
+
+    Returns:
+        The validated JobSpec.
+    """
+
+    with open(path) as job_file:
+        return JobSpec(**json.load(job_file))
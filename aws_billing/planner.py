@@ -0,0 +1,141 @@
+from .history import Spool
+from .throttle import fan_out
+
+
+def _chunks(values, size):
+    return [values[i : i + size] for i in range(0, len(values), size)] or [values]
+
+
+class TagQueryPlan:
+    """Coalesces the EC2 tag reports of several accounts into fewer Cost
+    Explorer queries.
+
+    Cost Explorer accepts two GroupBy keys and the tag reports use both
+    (TAG x USAGE_TYPE), so LINKED_ACCOUNT cannot be added to tell accounts
+    apart. Instead a tag value that get_tags reports for a single account is
+    attributed to that account: all such values are queried together,
+    filtered on every account. Each value shared by several accounts (the
+    untagged "" value, typically) gets one query grouped by LINKED_ACCOUNT x
+    USAGE_TYPE and filtered on that value. The plan is only coalesced when
+    this takes fewer queries than one query per account.
+    """
+
+    def __init__(self, tag_key, tags_by_account, chunk_size):
+        self.tag_key = tag_key
+        self.chunk_size = chunk_size
+        self.tags_by_account = {
+            account_id: list(dict.fromkeys(values))
+            for account_id, values in tags_by_account.items()
+        }
+        self.owners = {}
+        for account_id, values in self.tags_by_account.items():
+            for value in values:
+                self.owners.setdefault(value, []).append(account_id)
+        self.unique = [
+            value for value, owners in self.owners.items() if len(owners) == 1
+        ]
+        self.shared = {
+            value: owners for value, owners in self.owners.items() if len(owners) > 1
+        }
+        self.separate_calls = sum(
+            len(_chunks(values, chunk_size)) for values in self.tags_by_account.values()
+        )
+        self.coalesced_calls = len(self.queries(coalesced=True))
+        self.coalesced = (
+            len(self.tags_by_account) > 1 and self.coalesced_calls < self.separate_calls
+        )
+
+    @property
+    def calls(self):
+        return self.coalesced_calls if self.coalesced else self.separate_calls
+
+    @property
+    def saved(self):
+        return self.separate_calls - self.calls
+
+    def queries(self, coalesced=None):
+        """Returns the (account_ids, tag_values, by_account) of every query
+        of the coalesced plan, by_account meaning grouped by LINKED_ACCOUNT
+        x USAGE_TYPE rather than TAG x USAGE_TYPE."""
+
+        if not (self.coalesced if coalesced is None else coalesced):
+            return [
+                ([account_id], chunk, False)
+                for account_id, values in self.tags_by_account.items()
+                for chunk in _chunks(values, self.chunk_size)
+            ]
+        accounts = list(self.tags_by_account)
+        queries = []
+        if self.unique:
+            queries += [
+                (accounts, chunk, False)
+                for chunk in _chunks(self.unique, self.chunk_size)
+            ]
+        queries += [(owners, [value], True) for value, owners in self.shared.items()]
+        return queries
+
+    def fetch(self, run_query, max_workers=4):
+        """Runs the queries of the coalesced plan and splits their groups
+        per account.
+
+        Groups are routed to their account's Spool as the queries return
+        them, so memory stays flat however many groups the plan fetches.
+
+        Args:
+            run_query: A callable taking (account_ids, tag_values,
+                by_account) and returning the query's groups.
+            max_workers: The number of queries run at once.
+
+        Returns:
+            A dict mapping each account id to a Spool of its groups, keyed
+            TAG x USAGE_TYPE like those of a query on that account alone, in
+            the order the queries returned them.
+        """
+
+        spools = {account_id: Spool() for account_id in self.tags_by_account}
+
+        def route(query):
+            _, values, by_account = query
+            for group in run_query(*query):
+                if by_account:
+                    account_id, usage_type = group["Keys"]
+                    group["Keys"] = [f"{self.tag_key}${values[0]}", usage_type]
+                else:
+                    value = group["Keys"][0].split("$", 1)[-1]
+                    owners = self.owners.get(value)
+                    if owners is None:
+                        print(f"Skipping {self.tag_key} tag {value!r} of no account")
+                        continue
+                    account_id = owners[0]
+                spools[account_id].append(group)
+
+        fan_out(route, self.queries(coalesced=True), max_workers=max_workers)
+        return spools
+
+    def summary(self):
+        return (
+            f"Tag {self.tag_key}: {len(self.tags_by_account)} accounts in "
+            f"{self.calls} Cost Explorer queries instead of {self.separate_calls} "
+            f"({self.saved} saved)"
+        )
+
+
+def plan_tag_queries(tag_reports, chunk_size):
+    """Plans the Cost Explorer queries of a set of tag reports.
+
+    Args:
+        tag_reports: An iterable of (tag_key, account_id, tag_values)
+            tuples; reports on the same account and tag key share queries.
+        chunk_size: The maximum number of tag values per query.
+
+    Returns:
+        A dict mapping each tag key to its TagQueryPlan.
+    """
+
+    tags = {}
+    for tag_key, account_id, values in tag_reports:
+        tags.setdefault(tag_key, {}).setdefault(account_id, []).extend(values)
+    return {
+        tag_key: TagQueryPlan(tag_key, tags_by_account, chunk_size)
+        for tag_key, tags_by_account in tags.items()
+    }
@@ -0,0 +1,164 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+CACHE_DIR = os.getenv(
+    "AWS_BILLING_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "aws_billing"),
+)
+MONTH_TO_DATE_TTL = 6 * 60 * 60  # seconds
+CACHED_OPERATIONS = ("get_cost_and_usage", "get_tags")
+
+
+def request_key(namespace, operation, request):
+    """Returns a canonical hash of a Cost Explorer request.
+
+    Args:
+        namespace: The profile (or payer account) the request is issued for.
+        operation: The client method name, e.g. "get_cost_and_usage".
+        request: The keyword arguments of the call.
+
+    Returns:
+        A hex sha256 digest that does not depend on dict key order.
+    """
+
+    canonical = json.dumps(
+        {"namespace": namespace, "operation": operation, "request": request},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_closed_period(request, today=None):
+    """True if the request's TimePeriod ends before the current billing month."""
+    end = request.get("TimePeriod", {}).get("End")
+    if not end:
+        return False
+    today = today or datetime.date.today()
+    # End is exclusive, so a period ending on the 1st covers only past months
+    return str(end) <= today.replace(day=1).isoformat()
+
+
+def is_estimated(response):
+    """True if Cost Explorer still marks any ResultsByTime period of a
+    get_cost_and_usage response as Estimated."""
+    return any(result.get("Estimated") for result in response.get("ResultsByTime", ()))
+
+
+def is_final(request, response, today=None):
+    """True if a response will not change any more: its period is closed
+    (see is_closed_period) and none of its results is estimated."""
+    return is_closed_period(request, today) and not is_estimated(response)
+
+
+class ResponseCache:
+    """SQLite-backed store of Cost Explorer responses.
+
+    Final responses (closed months that Cost Explorer no longer marks as
+    Estimated, see is_final) are kept permanently; month-to-date and
+    estimated responses expire after ``ttl`` seconds. Each entry is one
+    zlib-compressed JSON document keyed by request_key.
+    """
+
+    def __init__(self, path=None, namespace=None, ttl=MONTH_TO_DATE_TTL):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, "ce_cache.sqlite3")
+        self.path = path
+        self.namespace = namespace or "default"
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " operation TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " expires REAL,"
+                " body BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?",
+                (time.time(),),
+            )
+
+    def get(self, operation, request):
+        key = request_key(self.namespace, operation, request)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < time.time()):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, operation, request, response):
+        key = request_key(self.namespace, operation, request)
+        now = time.time()
+        expires = None if is_final(request, response) else now + self.ttl
+        body = zlib.compress(
+            json.dumps(
+                {k: v for k, v in response.items() if k != "ResponseMetadata"},
+                default=str,
+            ).encode("utf-8")
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, operation, now, expires, body),
+            )
+
+    def count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def close(self):
+        self._conn.close()
+
+    def summary(self):
+        return f"Cost Explorer cache: {self.hits} hits, {self.misses} misses"
+
+
+class CachingClient:
+    """Wraps a Cost Explorer client so billed calls are served from a cache.
+
+    get_cost_and_usage and get_tags go through the ResponseCache (one entry
+    per page, since NextPageToken is part of the request); every other
+    attribute is delegated to the wrapped client. With ``refresh`` set the
+    cache is never read but still updated.
+    """
+
+    def __init__(self, client, cache, refresh=False):
+        self._client = client
+        self._cache = cache
+        self._refresh = refresh
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in CACHED_OPERATIONS:
+            return attr
+
+        def cached_call(**request):
+            if not self._refresh:
+                response = self._cache.get(name, request)
+                if response is not None:
+                    return response
+            else:
+                self._cache.count_miss()
+            response = attr(**request)
+            self._cache.put(name, request, response)
+            return response
+
+        return cached_call
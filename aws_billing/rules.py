@@ -0,0 +1,114 @@
+import re
+
+EXCLUDED_SUBSTRINGS = ("AWS-Out-Bytes", "DataTransfer")
+
+# Declarative classification rules for the tag reports.
+#
+# "exclude" lists the usage types (substrings or regular expressions) whose
+# rows are summed into the trailing "AWS Data Transfer" rows rather than
+# listed. "splits" assigns tags to buckets per account: a tag goes to the
+# first bucket whose names or patterns match it, otherwise to the default
+# bucket. Accounts without splits are reported whole.
+DEFAULT_RULES = {
+    "exclude": {"substrings": list(EXCLUDED_SUBSTRINGS), "patterns": []},
+    "splits": [
+        {
+            "accounts": ["943316794729"],
+            "buckets": [
+                {"name": "personal", "names": ["LN-BTSC-WEB1", "LN-BTSC-WEB2"]},
+                {"name": "btsc", "default": True},
+            ],
+        }
+    ],
+}
+
+
+def _combined_pattern(substrings=(), patterns=()):
+    """Compiles substrings and regular expressions into a single pattern."""
+    alternatives = [re.escape(substring) for substring in substrings]
+    alternatives += [f"(?:{pattern})" for pattern in patterns]
+    return re.compile("|".join(alternatives)) if alternatives else None
+
+
+class _CompiledSplit:
+    def __init__(self, buckets):
+        self.buckets = tuple(bucket["name"] for bucket in buckets)
+        self.default = next(
+            (bucket["name"] for bucket in buckets if bucket.get("default")), None
+        )
+        self.names = {}
+        self.patterns = []
+        for bucket in buckets:
+            for name in bucket.get("names", ()):
+                self.names.setdefault(name, bucket["name"])
+            pattern = _combined_pattern(patterns=bucket.get("patterns", ()))
+            if pattern is not None:
+                self.patterns.append((pattern, bucket["name"]))
+
+    def classify(self, name):
+        bucket = self.names.get(name)
+        if bucket is not None:
+            return bucket
+        for pattern, bucket in self.patterns:
+            if pattern.search(name):
+                return bucket
+        return self.default
+
+
+class ClassificationRules:
+    """A rule set compiled into hash sets and one combined regex per test.
+
+    Usage types are tested against a single alternation of every exclusion;
+    tags are looked up by exact name first and only then matched against
+    their split's patterns.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        exclude = rules.get("exclude", {})
+        self._excluded = _combined_pattern(
+            exclude.get("substrings", ()), exclude.get("patterns", ())
+        )
+        self._splits = {}
+        for split in rules.get("splits", ()):
+            compiled = _CompiledSplit(split["buckets"])
+            for account_id in split["accounts"]:
+                self._splits[account_id] = compiled
+
+    def is_excluded(self, dimension):
+        return self._excluded is not None and bool(self._excluded.search(dimension))
+
+    def buckets(self, account_id):
+        """Returns the bucket names of an account, empty if it is not split."""
+        split = self._splits.get(account_id)
+        return split.buckets if split else ()
+
+    def classifier(self, account_id, buckets=()):
+        """Returns a callable mapping a tag to its bucket, or None if the
+        account is not split.
+
+        Without an account_id, the first split defining one of buckets is
+        used.
+        """
+        if account_id is None:
+            split = next(
+                (
+                    split
+                    for split in self._splits.values()
+                    if set(buckets) & set(split.buckets)
+                ),
+                None,
+            )
+        else:
+            split = self._splits.get(account_id)
+        return split.classify if split else None
+
+
+_default_rules = None
+
+
+def default_rules():
+    """Returns DEFAULT_RULES compiled once per process."""
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = ClassificationRules(DEFAULT_RULES)
+    return _default_rules
@@ -0,0 +1,335 @@
+import csv
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from .metrics import METRICS
+
+INVALID_SHEET_CHARACTERS = re.compile(r"[\[\]:*?/\\]")
+MAX_SHEET_NAME_LENGTH = 31
+OUTPUT_FORMATS = ("xlsx", "csv", "jsonl", "parquet")
+AMOUNT_COLUMNS = ("Charges", "Previous", "Current", "Change", "Change %")
+PERIOD_HEADERS = ["Period Start", "Period End"]
+PARQUET_BATCH_ROWS = 10000
+
+
+class ExcelSink:
+    """Streams report rows into a write-only openpyxl workbook.
+
+    Rows are written to a temporary file as they are appended, so peak
+    memory does not grow with the number of rows. Each report goes into its
+    own sheet; the workbook is saved on close().
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._workbook = Workbook(write_only=True)
+        self._sheet_names = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _sheet_name(self, name):
+        name = INVALID_SHEET_CHARACTERS.sub("_", name)[:MAX_SHEET_NAME_LENGTH]
+        candidate, suffix = name, 1
+        while candidate.lower() in self._sheet_names:
+            suffix += 1
+            tail = f"~{suffix}"
+            candidate = name[: MAX_SHEET_NAME_LENGTH - len(tail)] + tail
+        self._sheet_names.add(candidate.lower())
+        return candidate
+
+    def sheet(self, sheet_name, headers):
+        """Adds a sheet with a bold header row and returns a SheetWriter
+        appending rows to it.
+
+        Sheets keep the order they were added in; rows may be appended to
+        several of them in any interleaving, from different threads.
+
+        Args:
+            sheet_name: The sheet title; invalid characters are replaced and
+                it is truncated and de-duplicated to fit Excel's rules.
+            headers: The column names.
+        """
+
+        with self._lock:
+            worksheet = self._workbook.create_sheet(self._sheet_name(sheet_name))
+            header_cells = []
+            for header in headers:
+                cell = WriteOnlyCell(worksheet, value=header)
+                cell.font = Font(bold=True)
+                header_cells.append(cell)
+            worksheet.append(header_cells)
+        return SheetWriter(worksheet, self._lock)
+
+    @METRICS.timed("write_sheet", rows=int)
+    def write_sheet(self, sheet_name, headers, rows):
+        """Appends a sheet with a bold header row followed by rows.
+
+        Args:
+            sheet_name: The sheet title (see sheet()).
+            headers: The column names.
+            rows: An iterable of row sequences, consumed as a stream.
+
+        Returns:
+            The number of rows written, excluding the header.
+        """
+
+        writer = self.sheet(sheet_name, headers)
+        for row in rows:
+            writer.append(row)
+        return writer.rows
+
+    @METRICS.timed("close_output")
+    def close(self):
+        if self._workbook is not None:
+            if not self._sheet_names:
+                self._workbook.create_sheet("Sheet1")
+            self._workbook.save(self.filename)
+            self._workbook = None
+
+
+class SheetWriter:
+    """Appends rows to one sheet of an ExcelSink."""
+
+    def __init__(self, worksheet, lock):
+        self._worksheet = worksheet
+        self._lock = lock
+        self.rows = 0
+
+    def append(self, row):
+        row = [None if value == "" else value for value in row]
+        with self._lock:
+            self._worksheet.append(row)
+        self.rows += 1
+
+
+class FileSink:
+    """Streams report rows into CSV, JSON Lines or Parquet files.
+
+    The counterpart of ExcelSink for formats without sheets: a single sink
+    writes its only sheet to path plus the format's extension, otherwise
+    every sheet becomes a file of its own in the directory path.
+    """
+
+    def __init__(self, path, output_format, single=False):
+        self.path = path
+        self.output_format = output_format
+        self.single = single
+        self._writers = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def sheet(self, sheet_name, headers):
+        """Opens the file of a sheet and returns a writer appending rows to
+        it (see ExcelSink.sheet)."""
+
+        with self._lock:
+            if self.single:
+                if self._writers:
+                    raise ValueError(f"{self.path} holds a single report")
+                filename = f"{self.path}.{self.output_format}"
+            else:
+                name = INVALID_SHEET_CHARACTERS.sub("_", sheet_name)
+                candidate, suffix = name, 1
+                while candidate.lower() in self._names:
+                    suffix += 1
+                    candidate = f"{name}~{suffix}"
+                self._names.add(candidate.lower())
+                filename = os.path.join(self.path, f"{candidate}.{self.output_format}")
+            os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+            writer = WRITERS[self.output_format](filename, headers)
+            self._writers.append(writer)
+        return writer
+
+    @METRICS.timed("close_output")
+    def close(self):
+        with self._lock:
+            for writer in self._writers:
+                writer.close()
+            self._writers = []
+
+
+class CSVWriter:
+    """Writes rows to a CSV file as they are appended."""
+
+    def __init__(self, filename, headers):
+        self._file = open(filename, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(headers)
+        self._lock = threading.Lock()
+        self.rows = 0
+
+    def append(self, row):
+        with self._lock:
+            self._writer.writerow(row)
+            self.rows += 1
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLinesWriter:
+    """Writes every row as a JSON object on a line of its own; empty
+    strings become nulls."""
+
+    def __init__(self, filename, headers):
+        self._file = open(filename, "w")
+        self._headers = list(headers)
+        self._lock = threading.Lock()
+        self.rows = 0
+
+    def append(self, row):
+        values = [None if value == "" else value for value in row]
+        line = json.dumps(dict(zip(self._headers, values)))
+        with self._lock:
+            self._file.write(line + "\n")
+            self.rows += 1
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Writes rows to a Parquet file in record batches of
+    PARQUET_BATCH_ROWS rows.
+
+    Amount columns (AMOUNT_COLUMNS) are float64, the period columns
+    (PERIOD_HEADERS, ISO dates in the rows) date32 and every other column a
+    string. Rows are buffered column by column,
+    so no DataFrame is built. Needs pyarrow.
+    """
+
+    def __init__(self, filename, headers):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        fields = [pa.field(header, _parquet_type(pa, header)) for header in headers]
+        self._schema = pa.schema(fields)
+        self._writer = pq.ParquetWriter(filename, self._schema)
+        self._dates = [header in PERIOD_HEADERS for header in headers]
+        self._columns = [[] for _ in fields]
+        self._lock = threading.Lock()
+        self.rows = 0
+
+    def append(self, row):
+        values = [None if value == "" else value for value in row]
+        with self._lock:
+            for column, is_date, value in zip(self._columns, self._dates, values):
+                if is_date and value is not None:
+                    value = datetime.date.fromisoformat(str(value))
+                column.append(value)
+            self.rows += 1
+            if len(self._columns[0]) >= PARQUET_BATCH_ROWS:
+                self._flush()
+
+    def _flush(self):
+        if self._columns[0]:
+            batch = self._pa.record_batch(
+                [
+                    self._pa.array(column, type=field.type)
+                    for column, field in zip(self._columns, self._schema)
+                ],
+                schema=self._schema,
+            )
+            self._writer.write_batch(batch)
+            self._columns = [[] for _ in self._columns]
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._writer.close()
+
+
+def _parquet_type(pa, header):
+    if header in AMOUNT_COLUMNS:
+        return pa.float64()
+    if header in PERIOD_HEADERS:
+        return pa.date32()
+    return pa.string()
+
+
+WRITERS = {"csv": CSVWriter, "jsonl": JSONLinesWriter, "parquet": ParquetWriter}
+
+
+def open_sink(path, output_format="xlsx", single=False):
+    """Returns the sink of an output format.
+
+    Args:
+        path: The output file or directory, without extension.
+        output_format: One of OUTPUT_FORMATS.
+        single: Whether the sink holds a single report.
+    """
+
+    if output_format == "xlsx":
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return ExcelSink(f"{path}.xlsx")
+    return FileSink(path, output_format, single)
+
+
+class ReportOutput:
+    """Streams the rows of one report into a sheet, keeping a short preview.
+
+    The sheet belongs to a shared sink (an ExcelSink or a FileSink), or is
+    the only sheet of an output of its own at path (see open_sink), closed
+    by close(). Only the first preview_rows rows are kept in memory. The
+    time spent appending rows is recorded as the "write_rows" stage,
+    whatever the sink.
+    """
+
+    def __init__(
+        self,
+        name,
+        headers,
+        sink=None,
+        path=None,
+        sheet_name="Sheet1",
+        preview_rows=0,
+        output_format="xlsx",
+    ):
+        self.name = name
+        self.headers = headers
+        self.preview_rows = preview_rows
+        self.preview = []
+        self._owned_sink = None
+        if sink is None:
+            sink = self._owned_sink = open_sink(path, output_format, single=True)
+        else:
+            sheet_name = name
+        self._sheet = sink.sheet(sheet_name, headers)
+
+    @property
+    def rows(self):
+        return self._sheet.rows
+
+    def append(self, row):
+        started = time.perf_counter()
+        self._sheet.append(row)
+        elapsed = time.perf_counter() - started
+        METRICS.exclude(elapsed)
+        METRICS.add_stage("write_rows", elapsed, rows=1)
+        if len(self.preview) < self.preview_rows:
+            self.preview.append(list(row))
+
+    def close(self):
+        if self._owned_sink is not None:
+            self._owned_sink.close()
+            self._owned_sink = None
@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import METRICS
+
+CE_REQUESTS_PER_SECOND = 5.0
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "LimitExceededException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+)
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+RATE_LIMITED_OPERATIONS = ("get_cost_and_usage", "get_tags")
+
+
+class TokenBucket:
+    """Thread-safe token bucket with additive-increase/multiplicative-decrease.
+
+    acquire() blocks until a token is available. Each throttle reported
+    through throttled() halves the refill rate; each success through
+    succeeded() nudges it back up towards the configured maximum.
+    """
+
+    def __init__(self, rate=CE_REQUESTS_PER_SECOND, capacity=None, min_rate=0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+def is_throttling_error(error):
+    """True for a botocore ClientError carrying a throttling error code.
+
+    Checked by shape rather than isinstance so importing this module does not
+    import botocore.
+    """
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(error):
+    """True for a server error or a dropped or timed out connection, which
+    botocore's standard retry mode would retry."""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return status in TRANSIENT_STATUS_CODES
+    from botocore.exceptions import ConnectionError, HTTPClientError
+
+    return isinstance(error, (ConnectionError, HTTPClientError))
+
+
+class ThrottledClient:
+    """Wraps a Cost Explorer client so billed calls share a TokenBucket.
+
+    get_cost_and_usage and get_tags wait for a token before every request
+    and are retried with jittered exponential backoff when Cost Explorer
+    answers with a throttling error, which also slows the bucket down, or a
+    transient one. This is the only retry layer of these calls: the
+    registry's Cost Explorer clients make a single attempt (see
+    clients.SELF_RETRIED_SERVICES). Other attributes are delegated.
+    """
+
+    def __init__(self, client, limiter, max_attempts=8, base_delay=0.5):
+        self._client = client
+        self._limiter = limiter
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self.throttles = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in RATE_LIMITED_OPERATIONS:
+            return attr
+
+        meta = getattr(self._client, "meta", None)
+        service = meta.service_model.service_name if meta else "ce"
+        operation = meta.method_to_api_mapping.get(name, name) if meta else name
+
+        def throttled_call(**request):
+            for attempt in range(self._max_attempts):
+                self._limiter.acquire()
+                try:
+                    response = attr(**request)
+                except Exception as e:
+                    throttled = is_throttling_error(e)
+                    if attempt + 1 == self._max_attempts or not (
+                        throttled or is_transient_error(e)
+                    ):
+                        raise
+                    METRICS.add_api(service, operation, retries=1)
+                    if throttled:
+                        self.throttles += 1
+                        self._limiter.throttled()
+                    delay = self._base_delay * 2**attempt
+                    time.sleep(random.uniform(delay / 2, delay))
+                    continue
+                self._limiter.succeeded()
+                return response
+
+        return throttled_call
+
+
+def fan_out(func, items, max_workers=4):
+    """Applies func to every item on a thread pool.
+
+    Args:
+        func: A callable taking one item.
+        items: The items to process.
+        max_workers: The number of concurrent workers.
+
+    Returns:
+        The list of results, in the same order as items regardless of which
+        call finished first.
+    """
+
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
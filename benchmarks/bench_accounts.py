@@ -0,0 +1,64 @@
+"""Benchmark of Account construction: validated model vs. the trusted path.
+
+Usage:
+    python -m benchmarks.bench_accounts --accounts 10000
+"""
+
+import time
+
+import click
+from tabulate import tabulate
+
+from aws_billing.objects.classes import Account
+
+from . import synthetic
+
+
+def records(accounts):
+    return [
+        {
+            "account_id": account["Id"],
+            "account_name": account["Name"],
+            "root_email": account["Email"],
+            "status": account["Status"],
+        }
+        for page in synthetic.list_accounts_pages(accounts, page_size=1000)
+        for account in page["Accounts"]
+    ]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@click.command()
+@click.option("--accounts", default=10000, help="Accounts to construct")
+@click.option("--repeat", default=5, help="Runs per path (best is reported)")
+def main(accounts, repeat):
+    data = records(accounts)
+    paths = [
+        ("Account(**record) (strict)", lambda: [Account(**r) for r in data]),
+        ("Account.trusted(**record)", lambda: [Account.trusted(**r) for r in data]),
+    ]
+    rows = []
+    for name, func in paths:
+        seconds = best_of(repeat, func)
+        rows.append(
+            [name, accounts, f"{seconds * 1000:.1f}", f"{seconds / accounts * 1e6:.2f}"]
+        )
+    print(
+        tabulate(
+            rows,
+            headers=["Path", "Accounts", "Total ms", "us/account"],
+            tablefmt="github",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark of cost cube queries over a synthetic DAILY history store.
+
+Usage:
+    python -m benchmarks.bench_cube --accounts 100 --days 90
+"""
+
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import click
+from tabulate import tabulate
+
+from aws_billing import aws_billing
+from aws_billing.cube import CostCube
+from aws_billing.history import CostHistoryStore, service_report_id, tag_report_id
+
+from . import synthetic
+
+START = "2024-01-01"
+
+
+def fill_store(store, accounts, days, tag_accounts, tag_values):
+    end = (
+        datetime.date.fromisoformat(START) + datetime.timedelta(days=days)
+    ).isoformat()
+    client = synthetic.FakeCostExplorer(
+        synthetic.cost_and_usage_pages(accounts=accounts, days=days)
+    )
+    rows = 0
+    for _ in store.record(
+        service_report_id(),
+        "DAILY",
+        START,
+        end,
+        aws_billing.iter_cost_and_usage_groups(client),
+    ):
+        rows += 1
+    for a in range(tag_accounts):
+        client = synthetic.FakeCostExplorer(
+            synthetic.tag_cost_pages(tag_values=tag_values, days=days, seed=a)
+        )
+        for _ in store.record(
+            tag_report_id("Name", synthetic.account_id(a)),
+            "DAILY",
+            START,
+            end,
+            aws_billing.iter_cost_and_usage_groups(client),
+        ):
+            rows += 1
+    return rows
+
+
+def random_range(rng, days):
+    first = rng.randrange(days - 1)
+    last = rng.randrange(first + 1, days + 1)
+    start = datetime.date.fromisoformat(START)
+    return (
+        (start + datetime.timedelta(days=first)).isoformat(),
+        (start + datetime.timedelta(days=last)).isoformat(),
+    )
+
+
+@click.command()
+@click.option("--accounts", default=100, help="Accounts in the service report")
+@click.option("--days", default=90, help="Days of DAILY history")
+@click.option("--tag_accounts", default=2, help="Accounts with a Name tag report")
+@click.option("--tag_values", default=200, help="Name tag values per account")
+@click.option("--queries", default=200, help="Random date ranges per grouping")
+def main(accounts, days, tag_accounts, tag_values, queries):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        store = CostHistoryStore(os.path.join(directory, "history.sqlite3"))
+        rows = fill_store(store, accounts, days, tag_accounts, tag_values)
+        store.offline = True
+        started = time.perf_counter()
+        cube = CostCube(store)
+        build_ms = (time.perf_counter() - started) * 1000
+        groupings = [
+            (("account",), None),
+            (("service",), None),
+            (("account", "service"), None),
+            (("service",), {"account": [synthetic.account_id(0)]}),
+            (("tag:Name",), None),
+            (("tag:Name", "usage_type"), {"account": [synthetic.account_id(0)]}),
+        ]
+        table = []
+        for group_by, filters in groupings:
+            started = time.perf_counter()
+            cube.query(group_by, START, random_range(rng, days)[1], filters)
+            first_ms = (time.perf_counter() - started) * 1000
+            timings = []
+            for _ in range(queries):
+                start, end = random_range(rng, days)
+                started = time.perf_counter()
+                cube.query(group_by, start, end, filters)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            table.append(
+                [
+                    ",".join(group_by) + (" (filtered)" if filters else ""),
+                    f"{first_ms:.1f}",
+                    f"{statistics.median(timings):.3f}",
+                    f"{timings[int(0.95 * (len(timings) - 1))]:.3f}",
+                ]
+            )
+        store.close()
+    print(f"{rows:,} stored DAILY rows, cube built in {build_ms:.1f} ms")
+    print(
+        tabulate(
+            table,
+            headers=["Grouping", "First ms", "p50 ms", "p95 ms"],
+            tablefmt="github",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
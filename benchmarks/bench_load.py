@@ -0,0 +1,215 @@
+"""End-to-end load test of the CLI against a local AWS stand-in.
+
+Runs the aws_billing CLI as a subprocess, exactly as run.sh does, with boto3
+pointed at fake_aws.FakeAWS, and reports wall time, API calls, injected
+throttles and retries per organization size and flow. The batch job is run
+with and without coalesced tag queries, and their reports must be equal.
+
+Usage:
+    python -m benchmarks.bench_load --accounts 10,100,1000 --latency 0.05 \
+        --throttle_rate 0.1
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from tabulate import tabulate
+
+from . import fake_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATES = ["--str_date", "2024-01-01", "--end_date", "2024-02-01"]
+
+
+def write_job_file(path, accounts, tag_reports):
+    spec = {
+        "entities": [
+            {
+                "name": "load",
+                "tag_reports": [
+                    {"account_name": f"AWS Account {i}", "tag_key": "Name"}
+                    for i in range(min(accounts, tag_reports))
+                ],
+            }
+        ]
+    }
+    with open(path, "w") as job_file:
+        json.dump(spec, job_file)
+
+
+def read_outputs(directory):
+    """Returns {path: sorted rows} for every workbook under directory."""
+    from openpyxl import load_workbook
+
+    outputs = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(".xlsx"):
+                continue
+            path = os.path.join(root, name)
+            workbook = load_workbook(path, read_only=True)
+            outputs[os.path.relpath(path, directory)] = sorted(
+                tuple(map(str, row))
+                for sheet in workbook.worksheets
+                for row in sheet.iter_rows(values_only=True)
+            )
+            workbook.close()
+    return outputs
+
+
+def run_flow(fake, directory, args):
+    """Runs the CLI once with a cold cache; returns (seconds, metrics,
+    outputs), outputs as read by read_outputs."""
+
+    env = {
+        key: value for key, value in os.environ.items() if not key.startswith("AWS_")
+    }
+    env.update(fake.environment())
+    env["AWS_CONFIG_FILE"] = os.path.join(directory, "aws-config")
+    env["AWS_SHARED_CREDENTIALS_FILE"] = os.path.join(directory, "aws-credentials")
+    env["AWS_BILLING_CACHE_DIR"] = os.path.join(directory, "cache")
+    # The CLI runs in directory, so the package is found through ROOT.
+    env["PYTHONPATH"] = ROOT
+    metrics_path = os.path.join(directory, "metrics.json")
+    command = [
+        sys.executable,
+        "-m",
+        "aws_billing.aws_billing",
+        "--no-cache",
+        "--preview",
+        "0",
+        "--metrics-out",
+        metrics_path,
+        *DATES,
+        *args,
+    ]
+    started = time.perf_counter()
+    completed = subprocess.run(
+        command, cwd=directory, env=env, capture_output=True, text=True
+    )
+    seconds = time.perf_counter() - started
+    if completed.returncode:
+        raise click.ClickException(
+            f"{' '.join(args) or 'main'} failed:\n{completed.stderr[-2000:]}"
+        )
+    with open(metrics_path) as metrics_file:
+        metrics = json.load(metrics_file)
+    return seconds, metrics, read_outputs(os.path.join(directory, "out"))
+
+
+def summarize(name, accounts, fake, seconds, metrics):
+    api = metrics["api"].values()
+    connections = metrics.get("connections", {}).values()
+    opened = sum(entry["connections"] for entry in connections)
+    sent = sum(entry["requests"] for entry in connections)
+    return [
+        accounts,
+        name,
+        f"{seconds:.2f}",
+        sum(fake.calls.values()),
+        ", ".join(f"{op}={n}" for op, n in sorted(fake.calls.items())),
+        sum(fake.throttles.values()),
+        sum(entry["retries"] for entry in api),
+        sum(entry["errors"] for entry in api),
+        f"{1 - opened / sent:.2f}" if sent else "-",
+    ]
+
+
+@click.command()
+@click.option("--accounts", default="10,100,1000", help="Organization sizes")
+@click.option("--tag_reports", default=10, help="Tag reports in the batch job")
+@click.option("--tags_per_account", default=20, help="Tag values per account")
+@click.option("--page_size", default=1000, help="Groups per Cost Explorer page")
+@click.option("--org_page_size", default=20, help="Accounts per list_accounts page")
+@click.option("--latency", default=0.02, help="Seconds added to every response")
+@click.option("--throttle_rate", default=0.05, help="Share of throttled requests")
+@click.option("--workers", default=4, help="batch --workers")
+@click.option("--ce_rate", default=50.0, help="batch --ce_rate")
+def main(
+    accounts,
+    tag_reports,
+    tags_per_account,
+    page_size,
+    org_page_size,
+    latency,
+    throttle_rate,
+    workers,
+    ce_rate,
+):
+    table = []
+    for size in [int(value) for value in accounts.split(",")]:
+        batch = [
+            "batch",
+            "job.json",
+            "--output_dir",
+            "out",
+            "--workers",
+            str(workers),
+            "--ce_rate",
+            str(ce_rate),
+        ]
+        reports = min(size, tag_reports)
+        flows = [
+            ("main (service report)", []),
+            (f"batch ({reports} tag reports)", batch),
+            (
+                f"batch ({reports} tag reports, --no_coalesce)",
+                [*batch, "--no_coalesce"],
+            ),
+        ]
+        outputs = []
+        for name, args in flows:
+            fake = fake_aws.FakeAWS(
+                accounts=size,
+                tags_per_account=tags_per_account,
+                org_page_size=org_page_size,
+                page_size=page_size,
+                latency=latency,
+                throttle_rate=throttle_rate,
+            )
+            fake.start()
+            try:
+                with tempfile.TemporaryDirectory() as directory:
+                    write_job_file(
+                        os.path.join(directory, "job.json"), size, tag_reports
+                    )
+                    seconds, metrics, output = run_flow(fake, directory, args)
+            finally:
+                fake.stop()
+            table.append(summarize(name, size, fake, seconds, metrics))
+            if args:
+                outputs.append(output)
+        if outputs[0] != outputs[1]:
+            raise click.ClickException(
+                f"{size} accounts: coalesced and separate tag queries disagree"
+            )
+    print(
+        f"latency {latency * 1000:.0f} ms, throttle rate {throttle_rate:.0%}, "
+        f"page size {page_size}"
+    )
+    print(
+        tabulate(
+            table,
+            headers=[
+                "Accounts",
+                "Flow",
+                "Wall s",
+                "Calls",
+                "Per operation",
+                "Throttled",
+                "Retries",
+                "Errors",
+                "Conn reuse",
+            ],
+            tablefmt="github",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Offline benchmark of the report pipeline stages on synthetic payloads.
+
+Usage:
+    python -m benchmarks.bench_pipeline --accounts 300 --days 30
+"""
+
+import contextlib
+import copy
+import io
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import boto3
+import click
+from botocore.stub import Stubber
+from tabulate import tabulate
+
+from aws_billing import aws_billing
+from aws_billing.objects.directory import AccountDirectory
+
+from . import synthetic
+
+
+def stubbed_org_client(accounts, page_size):
+    """Returns a real organizations client answering list_accounts from a Stubber."""
+    client = boto3.client(
+        "organizations",
+        region_name="us-east-1",
+        aws_access_key_id="bench",
+        aws_secret_access_key="bench",
+    )
+    stubber = Stubber(client)
+    pages = list(synthetic.list_accounts_pages(accounts, page_size))
+    for i, page in enumerate(pages):
+        response = dict(page)
+        if i + 1 < len(pages):
+            response["NextToken"] = f"token-{i + 1}"
+        stubber.add_response("list_accounts", response)
+    stubber.activate()
+    return client
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(name, rows, func, repeat):
+    """Runs the stage repeat times, then once more under tracemalloc.
+
+    func builds a fresh zero-argument stage callable, so setup (such as
+    copying pages) is not timed. Timed runs are not traced because
+    tracemalloc slows allocation-heavy code several-fold.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        stage = func()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stage()
+        timings.append(time.perf_counter() - start)
+    stage = func()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    median = statistics.median(timings)
+    return [
+        name,
+        rows,
+        f"{rows / median:,.0f}" if median else "-",
+        f"{median * 1000:.1f}",
+        f"{percentile(timings, 0.95) * 1000:.1f}",
+        f"{max(timings) * 1000:.1f}",
+        f"{peak / 2**20:.1f}",
+    ]
+
+
+@click.command()
+@click.option("--accounts", default=300, help="Organization accounts")
+@click.option("--services", default=40, help="Services per account")
+@click.option("--usage_types", default=9, help="Usage types per tag value")
+@click.option("--tag_values", default=500, help="Distinct Name tag values")
+@click.option("--days", default=30, help="Days (one ResultsByTime entry each)")
+@click.option("--page_size", default=5000, help="Groups per Cost Explorer page")
+@click.option("--repeat", default=5, help="Runs per stage")
+def main(accounts, services, usage_types, tag_values, days, page_size, repeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+        account_list = AccountDirectory(
+            aws_billing.get_list_of_accounts(stubbed_org_client(accounts, 20))
+        )
+    service_pages = synthetic.cost_and_usage_pages(
+        accounts, services, days, page_size=page_size
+    )
+    tag_pages = synthetic.tag_cost_pages(
+        tag_values, usage_types, days, page_size=page_size
+    )
+    service_rows = accounts * services * days
+    tag_rows = tag_values * usage_types * days
+
+    def groups(pages):
+        return aws_billing.iter_cost_and_usage_groups(
+            synthetic.FakeCostExplorer(copy.deepcopy(pages))
+        )
+
+    service_table = aws_billing.process_billing_results(groups(service_pages), [])
+    pairs = [(row[0], row[2]) for row in service_table]
+    output_dir = tempfile.mkdtemp()
+
+    results = [
+        measure(
+            "get_list_of_accounts",
+            accounts,
+            lambda: (lambda client: lambda: aws_billing.get_list_of_accounts(client))(
+                stubbed_org_client(accounts, 20)
+            ),
+            repeat,
+        ),
+        measure(
+            "process_billing_results",
+            service_rows,
+            lambda: (
+                lambda g: lambda: aws_billing.process_billing_results(g, account_list)
+            )(groups(service_pages)),
+            repeat,
+        ),
+        measure(
+            "process_billing_results_tags",
+            tag_rows,
+            lambda: (
+                lambda g: lambda: aws_billing.process_billing_results_tags(
+                    g, account_list
+                )
+            )(groups(tag_pages)),
+            repeat,
+        ),
+        measure(
+            "sum_by_group",
+            len(pairs),
+            lambda: lambda: aws_billing.sum_by_group(pairs),
+            repeat,
+        ),
+        measure(
+            "tabulate_to_excel",
+            len(service_table),
+            lambda: lambda: aws_billing.tabulate_to_excel(
+                service_table,
+                headers=aws_billing.SERVICE_HEADERS,
+                filename=os.path.join(output_dir, "bench.xlsx"),
+            ),
+            repeat,
+        ),
+    ]
+    print(
+        tabulate(
+            results,
+            headers=[
+                "Stage",
+                "Rows",
+                "Rows/s",
+                "p50 ms",
+                "p95 ms",
+                "max ms",
+                "Peak MiB",
+            ],
+            tablefmt="github",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""In-process HTTP stand-in for the Organizations and Cost Explorer APIs.
+
+Serves list_accounts, get_tags and get_cost_and_usage over botocore's JSON
+protocol (the operation is read from the X-Amz-Target header), so real
+boto3 clients can target it through endpoint_url or the
+AWS_ENDPOINT_URL_<SERVICE> variables (see FakeAWS.environment). Responses
+are generated from the request's GroupBy and Filter, paginated with
+configurable page sizes, and can be delayed and throttled.
+
+Every (day, account, tag, service, usage type) cell has a fixed cost in
+cents and a response sums the cells into the requested periods and
+groups, so any two queries over the same cells agree to the cent, whatever
+their granularity and grouping.
+"""
+
+import datetime
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import synthetic
+
+TARGETS = {
+    "AWSOrganizationsV20161128.ListAccounts": "ListAccounts",
+    "AWSInsightsIndexService.GetTags": "GetTags",
+    "AWSInsightsIndexService.GetCostAndUsage": "GetCostAndUsage",
+}
+THROTTLING_ERRORS = {
+    "ListAccounts": "TooManyRequestsException",
+    "GetTags": "LimitExceededException",
+    "GetCostAndUsage": "LimitExceededException",
+}
+
+
+def _weight(modulus, *keys):
+    """A deterministic integer in [0, modulus) for a combination of keys."""
+    return zlib.crc32("\0".join(keys).encode()) % modulus
+
+
+def _days(period):
+    day = datetime.date.fromisoformat(period["Start"])
+    last = datetime.date.fromisoformat(period["End"])
+    while day < last:
+        yield day.isoformat()
+        day += datetime.timedelta(days=1)
+
+
+def _periods(start, end, granularity):
+    day = datetime.date.fromisoformat(start)
+    last = datetime.date.fromisoformat(end)
+    while day < last:
+        if granularity == "DAILY":
+            following = day + datetime.timedelta(days=1)
+        else:
+            following = (day.replace(day=28) + datetime.timedelta(days=4)).replace(
+                day=1
+            )
+        following = min(following, last)
+        yield {"Start": day.isoformat(), "End": following.isoformat()}
+        day = following
+
+
+def _filter_values(expression, found=None):
+    """Collects the LINKED_ACCOUNT and tag values a Filter restricts to,
+    ignoring Not clauses."""
+    found = {} if found is None else found
+    for clause in expression.get("And", ()):
+        _filter_values(clause, found)
+    if "Dimensions" in expression:
+        found[expression["Dimensions"]["Key"]] = expression["Dimensions"]["Values"]
+    if "Tags" in expression:
+        found["TAG"] = expression["Tags"]["Values"]
+    return found
+
+
+class FakeAWS:
+    """The synthetic organization behind the stub and its counters.
+
+    Args:
+        accounts: The number of member accounts.
+        tags_per_account: Tag values per account, besides the untagged ""
+            value every account has.
+        org_page_size: Accounts per list_accounts page.
+        page_size: Groups (or tags) per Cost Explorer page.
+        latency: Seconds added to every response.
+        throttle_rate: The probability of answering a request with a
+            throttling error instead; when above 0, the first request of
+            each operation is always throttled.
+        seed: Seeds the throttling decisions.
+    """
+
+    def __init__(
+        self,
+        accounts=10,
+        tags_per_account=20,
+        org_page_size=20,
+        page_size=5000,
+        latency=0.0,
+        throttle_rate=0.0,
+        seed=0,
+    ):
+        self.accounts = [synthetic.account_id(i) for i in range(accounts)]
+        self.tags_per_account = tags_per_account
+        self.org_page_size = org_page_size
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self.throttles = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._results = {}
+        self._server = None
+
+    def account_tags(self, account_id):
+        return [""] + [f"{account_id}-web-{i}" for i in range(self.tags_per_account)]
+
+    def handle(self, operation, request):
+        """Returns the (status, body) of one request."""
+
+        with self._lock:
+            self.calls[operation] += 1
+            # The first call of each operation is throttled whenever the
+            # rate is set, so even small runs exercise the retries.
+            throttled = self.throttle_rate > 0 and (
+                self.calls[operation] == 1 or self._rng.random() < self.throttle_rate
+            )
+            if throttled:
+                self.throttles[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return 400, {
+                "__type": THROTTLING_ERRORS[operation],
+                "message": "Rate exceeded",
+            }
+        if operation == "ListAccounts":
+            return 200, self.list_accounts(request)
+        if operation == "GetTags":
+            return 200, self.get_tags(request)
+        return 200, self.get_cost_and_usage(request)
+
+    def list_accounts(self, request):
+        first = int(request.get("NextToken") or 0)
+        last = first + self.org_page_size
+        response = {
+            "Accounts": [
+                {
+                    "Id": account_id,
+                    "Arn": f"arn:aws:organizations::000000000000:account/o-x/{account_id}",
+                    "Name": f"AWS Account {i}",
+                    "Email": f"aws+{i}@example.com",
+                    "Status": "ACTIVE",
+                }
+                for i, account_id in enumerate(self.accounts[first:last], first)
+            ]
+        }
+        if last < len(self.accounts):
+            response["NextToken"] = str(last)
+        return response
+
+    def get_tags(self, request):
+        accounts = _filter_values(request.get("Filter", {})).get(
+            "LINKED_ACCOUNT", self.accounts
+        )
+        tags = list(
+            dict.fromkeys(
+                tag for account in accounts for tag in self.account_tags(account)
+            )
+        )
+        first = int(request.get("NextPageToken") or 0)
+        last = first + self.page_size
+        response = {"Tags": tags[first:last], "ReturnSize": len(tags[first:last])}
+        response["TotalSize"] = len(tags)
+        if last < len(tags):
+            response["NextPageToken"] = str(last)
+        return response
+
+    def _groups(self, request):
+        """Returns every (period, group) of a query, before pagination.
+
+        A cell costs (1 + w5(day, account)) * w4(account, tag) *
+        w10(account, service) * w7(service, usage type) cents, wN being a
+        _weight modulo N, so the cells of each period and account are summed
+        into the GroupBy keys by summing the day, tag and (service, usage
+        type) factors separately over the values left out, then multiplying.
+        """
+
+        group_by = [
+            group["Key"] if group["Type"] == "DIMENSION" else "TAG"
+            for group in request.get("GroupBy", ())
+        ]
+        tag_key = next(
+            (g["Key"] for g in request.get("GroupBy", ()) if g["Type"] == "TAG"),
+            None,
+        )
+        restrict = _filter_values(request.get("Filter", {}))
+        accounts = restrict.get("LINKED_ACCOUNT", self.accounts)
+        services = restrict.get("SERVICE", synthetic.SERVICES)
+        usage_types = restrict.get("USAGE_TYPE", synthetic.USAGE_TYPES)
+        tag_filter = set(restrict["TAG"]) if "TAG" in restrict else None
+        rows = []
+        for period in _periods(
+            request["TimePeriod"]["Start"],
+            request["TimePeriod"]["End"],
+            request.get("Granularity", "MONTHLY"),
+        ):
+            days = list(_days(period))
+            totals = {}
+            for account_id in accounts:
+                day_weight = sum(1 + _weight(5, day, account_id) for day in days)
+                tags = {}
+                for tag in self.account_tags(account_id):
+                    if tag_filter is None or tag in tag_filter:
+                        key = f"{tag_key}${tag}" if "TAG" in group_by else None
+                        tags[key] = tags.get(key, 0) + _weight(4, account_id, tag)
+                usage = {}
+                for service in services:
+                    service_weight = _weight(10, account_id, service)
+                    for usage_type in usage_types:
+                        key = (
+                            service if "SERVICE" in group_by else None,
+                            usage_type if "USAGE_TYPE" in group_by else None,
+                        )
+                        usage[key] = usage.get(key, 0) + service_weight * _weight(
+                            7, service, usage_type
+                        )
+                for tag, tag_weight in tags.items():
+                    for (service, usage_type), usage_weight in usage.items():
+                        values = {
+                            "LINKED_ACCOUNT": account_id,
+                            "SERVICE": service,
+                            "USAGE_TYPE": usage_type,
+                            "TAG": tag,
+                        }
+                        key = tuple(values[dimension] for dimension in group_by)
+                        totals[key] = (
+                            totals.get(key, 0) + day_weight * tag_weight * usage_weight
+                        )
+            rows += [
+                (
+                    period,
+                    {
+                        "Keys": list(key),
+                        "Metrics": {
+                            "UnblendedCost": {
+                                "Amount": repr(cents / 100),
+                                "Unit": "USD",
+                            }
+                        },
+                    },
+                )
+                for key, cents in totals.items()
+            ]
+        return rows
+
+    def get_cost_and_usage(self, request):
+        token = request.pop("NextPageToken", None)
+        key = json.dumps(request, sort_keys=True)
+        with self._lock:
+            rows = self._results.get(key)
+        if rows is None:
+            rows = self._groups(request)
+            with self._lock:
+                self._results[key] = rows
+        first = int(token or 0)
+        last = first + self.page_size
+        results = {}
+        for period, group in rows[first:last]:
+            results.setdefault((period["Start"], period["End"]), []).append(group)
+        response = {
+            "ResultsByTime": [
+                {
+                    "TimePeriod": {"Start": start, "End": end},
+                    "Total": {},
+                    "Groups": groups,
+                    "Estimated": False,
+                }
+                for (start, end), groups in results.items()
+            ],
+            "DimensionValueAttributes": [],
+        }
+        if last < len(rows):
+            response["NextPageToken"] = str(last)
+        return response
+
+    def start(self):
+        """Starts serving on a free local port; returns the endpoint URL."""
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                operation = TARGETS.get(self.headers.get("X-Amz-Target"))
+                if operation is None:
+                    status, response = 400, {
+                        "__type": "UnknownOperationException",
+                        "message": self.headers.get("X-Amz-Target", ""),
+                    }
+                else:
+                    status, response = fake.handle(operation, json.loads(body or b"{}"))
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-amz-json-1.1")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("x-amzn-RequestId", "fake")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.endpoint
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def environment(self):
+        """Returns the variables pointing boto3 at the stub with dummy
+        credentials."""
+        return {
+            "AWS_ENDPOINT_URL_COST_EXPLORER": self.endpoint,
+            "AWS_ENDPOINT_URL_ORGANIZATIONS": self.endpoint,
+            "AWS_ACCESS_KEY_ID": "fake",
+            "AWS_SECRET_ACCESS_KEY": "fake",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
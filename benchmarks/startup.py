@@ -0,0 +1,81 @@
+"""Startup-time regression check for the aws_billing CLI.
+
+Runs ``python -X importtime -m aws_billing.aws_billing [SUBCOMMAND] --help``
+for every subcommand, reports the total import cost and the heaviest
+imports, and fails if a budget is exceeded or a heavy dependency is
+imported on a path that should not need it.
+
+Usage:
+    python -m benchmarks.startup --budget_ms 150
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+import click
+from tabulate import tabulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBCOMMANDS = ["", "accounts", "batch", "cube", "diff", "sync"]
+HEAVY_MODULES = ("boto3", "botocore", "pandas", "numpy", "openpyxl", "pydantic")
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_times(args):
+    """Returns {module: (self_us, cumulative_us)} for a CLI invocation."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "aws_billing.aws_billing", *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return times
+
+
+@click.command()
+@click.option("--budget_ms", default=150.0, help="Maximum total import time")
+@click.option("--top", default=5, help="Heaviest imports to list")
+def main(budget_ms, top):
+    rows = []
+    failures = []
+    for subcommand in SUBCOMMANDS:
+        args = [subcommand, "--help"] if subcommand else ["--help"]
+        times = import_times(args)
+        total_ms = sum(own for own, _ in times.values()) / 1000
+        heavy = sorted(
+            {m.split(".")[0] for m in times if m.split(".")[0] in HEAVY_MODULES}
+        )
+        heaviest = sorted(times.items(), key=lambda item: -item[1][0])[:top]
+        rows.append(
+            [
+                subcommand or "(main)",
+                f"{total_ms:.1f}",
+                ", ".join(heavy) or "-",
+                ", ".join(f"{m} {own / 1000:.1f}" for m, (own, _) in heaviest),
+            ]
+        )
+        if total_ms > budget_ms:
+            failures.append(f"{subcommand or 'main'}: {total_ms:.1f} ms > {budget_ms}")
+        if heavy:
+            failures.append(f"{subcommand or 'main'} --help imports {', '.join(heavy)}")
+    print(
+        tabulate(
+            rows,
+            headers=["Subcommand", "Import ms", "Heavy modules", "Heaviest (ms)"],
+            tablefmt="github",
+        )
+    )
+    if failures:
+        raise click.ClickException("; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Synthetic Organizations and Cost Explorer payloads for offline benchmarks."""
+
+import datetime
+import random
+
+SERVICES = [
+    "Amazon Elastic Compute Cloud - Compute",
+    "EC2 - Other",
+    "Amazon Simple Storage Service",
+    "Amazon Relational Database Service",
+    "AWS Lambda",
+    "Amazon CloudFront",
+    "AWS Data Transfer",
+    "Amazon Virtual Private Cloud",
+    "AmazonCloudWatch",
+    "AWS Key Management Service",
+]
+USAGE_TYPES = [
+    "BoxUsage:t3.medium",
+    "BoxUsage:m5.large",
+    "EBS:VolumeUsage.gp3",
+    "EBS:SnapshotUsage",
+    "DataTransfer-Out-Bytes",
+    "DataTransfer-Regional-Bytes",
+    "USE1-AWS-Out-Bytes",
+    "NatGateway-Hours",
+    "ElasticIP:IdleAddress",
+]
+
+
+def account_id(i):
+    return f"{100000000000 + i:012d}"
+
+
+def list_accounts_pages(accounts, page_size=20):
+    """Yields list_accounts pages for the given number of accounts."""
+    for first in range(0, accounts, page_size):
+        yield {
+            "Accounts": [
+                {
+                    "Id": account_id(i),
+                    "Arn": f"arn:aws:organizations::000000000000:account/o-x/{account_id(i)}",
+                    "Name": f"AWS Account {i}",
+                    "Email": f"aws+{i}@example.com",
+                    "Status": "ACTIVE",
+                }
+                for i in range(first, min(first + page_size, accounts))
+            ]
+        }
+
+
+def _days(start, days):
+    start = datetime.date.fromisoformat(start)
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        yield day.isoformat(), (day + datetime.timedelta(days=1)).isoformat()
+
+
+def _cost(rng):
+    if rng.random() < 0.05:
+        return "0"
+    return repr(rng.lognormvariate(1, 2))
+
+
+def cost_and_usage_pages(
+    accounts=50,
+    services=len(SERVICES),
+    days=1,
+    start="2024-01-01",
+    page_size=5000,
+    seed=0,
+):
+    """Yields get_cost_and_usage pages grouped by LINKED_ACCOUNT and SERVICE.
+
+    One group per account, service and day; days > 1 produces one
+    ResultsByTime entry per day, as a DAILY query does. Groups are split
+    into pages of page_size with NextPageToken set on all but the last.
+    """
+
+    rng = random.Random(seed)
+    names = SERVICES[:services] + [
+        f"Service {i}" for i in range(services - len(SERVICES))
+    ]
+    return _paginate(
+        (
+            (
+                {"Start": day_start, "End": day_end},
+                {
+                    "Keys": [account_id(a), service],
+                    "Metrics": {"UnblendedCost": {"Amount": _cost(rng), "Unit": "USD"}},
+                },
+            )
+            for day_start, day_end in _days(start, days)
+            for a in range(accounts)
+            for service in names
+        ),
+        page_size,
+    )
+
+
+def tag_cost_pages(
+    tag_values=200,
+    usage_types=len(USAGE_TYPES),
+    days=1,
+    start="2024-01-01",
+    tag_key="Name",
+    page_size=5000,
+    seed=0,
+):
+    """Yields get_cost_and_usage pages grouped by TAG and USAGE_TYPE."""
+
+    rng = random.Random(seed)
+    values = ["", "LN-BTSC-WEB1", "LN-BTSC-WEB2"] + [
+        f"web-{i}" for i in range(max(0, tag_values - 3))
+    ]
+    names = USAGE_TYPES[:usage_types] + [
+        f"Usage:{i}" for i in range(usage_types - len(USAGE_TYPES))
+    ]
+    return _paginate(
+        (
+            (
+                {"Start": day_start, "End": day_end},
+                {
+                    "Keys": [f"{tag_key}${value}", usage],
+                    "Metrics": {"UnblendedCost": {"Amount": _cost(rng), "Unit": "USD"}},
+                },
+            )
+            for day_start, day_end in _days(start, days)
+            for value in values[:tag_values]
+            for usage in names
+        ),
+        page_size,
+    )
+
+
+def _paginate(period_groups, page_size):
+    chunks, results, count = [], {}, 0
+    for period, group in period_groups:
+        results.setdefault((period["Start"], period["End"]), []).append(group)
+        count += 1
+        if count == page_size:
+            chunks.append(results)
+            results, count = {}, 0
+    if results:
+        chunks.append(results)
+    pages = []
+    for i, results in enumerate(chunks):
+        response = {
+            "ResultsByTime": [
+                {"TimePeriod": {"Start": s, "End": e}, "Groups": groups}
+                for (s, e), groups in results.items()
+            ]
+        }
+        if i + 1 < len(chunks):
+            response["NextPageToken"] = f"page-{i + 1}"
+        pages.append(response)
+    return pages
+
+
+class FakeOrganizations:
+    """Minimal organizations client serving synthetic list_accounts pages."""
+
+    def __init__(self, accounts, page_size=20):
+        self._pages = list(list_accounts_pages(accounts, page_size))
+
+    def get_paginator(self, operation_name):
+        pages = self._pages
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                return iter(pages)
+
+        return Paginator()
+
+
+class FakeCostExplorer:
+    """Minimal Cost Explorer client replaying pre-built pages by token."""
+
+    def __init__(self, pages, tags=()):
+        self._pages = pages
+        self._tags = list(tags)
+        self.calls = 0
+
+    def get_cost_and_usage(self, **request):
+        self.calls += 1
+        token = request.get("NextPageToken")
+        index = int(token.split("-")[1]) if token else 0
+        return self._pages[index]
+
+    def get_tags(self, **request):
+        self.calls += 1
+        return {"Tags": self._tags}
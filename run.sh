@@ -1,7 +1,12 @@
 #!/bin/sh
 source .venv/bin/activate
+# format yyyy-mm-dd
 START_DATE=$1
 END_DATE=$2
-bash run_961.sh $1 $2
-bash run_leb.sh $1 $2
-bash run_ksa.sh $1 $2
\ No newline at end of file
+for profile in kloudr-961 kloudr-leb kloudr-ksa; do
+    echo "AWS Login to $profile"
+    aws login --profile $profile
+done
+python -m aws_billing.aws_billing --str_date $START_DATE --end_date $END_DATE \
+    batch jobs/kloudr-961.json jobs/kloudr-leb.json jobs/kloudr-ksa.json \
+    --profiles kloudr-961,kloudr-leb,kloudr-ksa
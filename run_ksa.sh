@@ -8,13 +8,4 @@ aws login
 
 start_date=$1
 end_date=$2
-python aws_billing/aws_billing.py  --str_date $start_date --end_date $end_date --entity ksa
-
-
-DIRECTORY="./excel_output/ksa"
-if [ -d "$DIRECTORY" ]; then
-    mv ./excel_output/*.xlsx $DIRECTORY
-else
-    mkdir $DIRECTORY
-    mv ./excel_output/*.xlsx $DIRECTORY
-fi
\ No newline at end of file
+python -m aws_billing.aws_billing  --str_date $start_date --end_date $end_date batch jobs/kloudr-ksa.json
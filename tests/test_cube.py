@@ -0,0 +1,109 @@
+import datetime
+
+import pytest
+
+from aws_billing.cube import ACCOUNT, USAGE_TYPE, CostCube, CubeMiss
+from aws_billing.history import CostHistoryStore, service_report_id, tag_report_id
+
+START, END = "2024-01-01", "2024-01-11"
+
+
+def groups(start, end, granularity, keys):
+    """One group of 1.0 USD per key and period of [start, end)."""
+
+    day = datetime.date.fromisoformat(start)
+    last = datetime.date.fromisoformat(end)
+    step = datetime.timedelta(days=1 if granularity == "DAILY" else (last - day).days)
+    while day < last:
+        period = {"Start": day.isoformat(), "End": (day + step).isoformat()}
+        for key in keys:
+            yield {
+                "TimePeriod": period,
+                "Keys": list(key),
+                "Metrics": {"UnblendedCost": {"Amount": "1.0", "Unit": "USD"}},
+            }
+        day += step
+
+
+def record(store, report, granularity, keys, start=START, end=END):
+    for _ in store.record(
+        report, granularity, start, end, groups(start, end, granularity, keys)
+    ):
+        pass
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A store mixing DAILY, MONTHLY-only and partially synced reports."""
+
+    store = CostHistoryStore(str(tmp_path / "history.sqlite3"))
+    record(
+        store,
+        service_report_id(),
+        "DAILY",
+        [("111111111111", "EC2"), ("222222222222", "EC2"), ("333333333333", "S3")],
+    )
+    record(store, tag_report_id("Name", "111111111111"), "DAILY", [("Name$web", "U")])
+    record(store, tag_report_id("Name", "222222222222"), "MONTHLY", [("Name$db", "U")])
+    record(
+        store,
+        tag_report_id("Name", "333333333333"),
+        "DAILY",
+        [("Name$api", "U")],
+        end="2024-01-06",
+    )
+    yield store
+    store.close()
+
+
+def test_service_grain_ignores_tag_reports(store):
+    rows = CostCube(store).query([ACCOUNT], START, END)
+    assert sorted(rows) == [
+        ["111111111111", 10.0, "USD"],
+        ["222222222222", 10.0, "USD"],
+        ["333333333333", 10.0, "USD"],
+    ]
+
+
+def test_monthly_only_report_is_skipped(store):
+    cube = CostCube(store)
+    rows = cube.query([ACCOUNT, "tag:Name"], START, END, {ACCOUNT: ["111111111111"]})
+    assert rows == [["111111111111", "web", 10.0, "USD"]]
+    with pytest.raises(CubeMiss):
+        cube.query(["tag:Name"], START, END, {ACCOUNT: ["222222222222"]})
+
+
+def test_coverage_is_checked_per_filtered_account(store):
+    cube = CostCube(store)
+    with pytest.raises(CubeMiss):
+        cube.query([ACCOUNT, "tag:Name"], START, END)
+    rows = cube.query([ACCOUNT, "tag:Name"], START, "2024-01-06")
+    assert sorted(rows) == [
+        ["111111111111", "web", 5.0, "USD"],
+        ["333333333333", "api", 5.0, "USD"],
+    ]
+
+
+def test_account_totals_only_come_from_the_service_grain(tmp_path):
+    store = CostHistoryStore(str(tmp_path / "history.sqlite3"))
+    record(
+        store,
+        service_report_id(),
+        "DAILY",
+        [("111111111111", "EC2")],
+        start="2024-02-01",
+        end="2024-02-11",
+    )
+    record(store, tag_report_id("Name", "111111111111"), "DAILY", [("Name$web", "U")])
+    cube = CostCube(store)
+    try:
+        with pytest.raises(CubeMiss):
+            cube.query([ACCOUNT], START, END)
+        assert cube.query([ACCOUNT], "2024-02-01", "2024-02-11") == [
+            ["111111111111", 10.0, "USD"]
+        ]
+        assert cube.query([ACCOUNT, USAGE_TYPE], START, END) == [
+            ["111111111111", "U", 10.0, "USD"]
+        ]
+    finally:
+        store.close()
@@ -0,0 +1,68 @@
+import datetime
+import sqlite3
+
+from aws_billing.history import CostHistoryStore, service_report_id
+
+REPORT = service_report_id()
+
+
+def groups(start, days, estimated):
+    day = datetime.date.fromisoformat(start)
+    for _ in range(days):
+        following = day + datetime.timedelta(days=1)
+        yield {
+            "TimePeriod": {"Start": day.isoformat(), "End": following.isoformat()},
+            "Keys": ["111111111111", "EC2"],
+            "Metrics": {"UnblendedCost": {"Amount": "1.0", "Unit": "USD"}},
+            "Estimated": estimated,
+        }
+        day = following
+
+
+def record(store, start, end, estimated):
+    days = (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days
+    for _ in store.record(REPORT, "DAILY", start, end, groups(start, days, estimated)):
+        pass
+
+
+def test_estimated_rows_of_closed_months_are_not_covered(tmp_path):
+    store = CostHistoryStore(str(tmp_path / "history.sqlite3"))
+    record(store, "2024-01-01", "2024-02-01", estimated=True)
+    record(store, "2024-02-01", "2024-03-01", estimated=False)
+    assert store.covering_granularity(REPORT, "2024-01-01", "2024-02-01") is None
+    assert store.covering_granularity(REPORT, "2024-02-01", "2024-03-01") == "DAILY"
+    assert [
+        group["Estimated"]
+        for group in store.iter_groups(REPORT, "2024-01-01", "2024-03-01", "DAILY")
+    ] == [True, False]
+    assert store.sync_window(
+        REPORT, "2024-01-01", today=datetime.date(2024, 3, 10)
+    ) == ("2024-01-01", "2024-03-10")
+    record(store, "2024-01-01", "2024-02-01", estimated=False)
+    assert store.covering_granularity(REPORT, "2024-01-01", "2024-02-01") == "DAILY"
+    store.close()
+
+
+def test_estimated_rows_of_the_current_month_are_covered(tmp_path):
+    store = CostHistoryStore(str(tmp_path / "history.sqlite3"))
+    start = datetime.date.today().replace(day=1)
+    end = start + datetime.timedelta(days=1)
+    record(store, start.isoformat(), end.isoformat(), estimated=True)
+    assert store.covering_granularity(REPORT, start, end) == "DAILY"
+    store.close()
+
+
+def test_stores_without_the_estimated_column_are_migrated(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE cost_groups (payer TEXT NOT NULL, report TEXT NOT NULL,"
+        " granularity TEXT NOT NULL, period_start TEXT NOT NULL,"
+        " period_end TEXT NOT NULL, key1 TEXT NOT NULL, key2 TEXT,"
+        " amount REAL NOT NULL, unit TEXT NOT NULL)"
+    )
+    conn.close()
+    store = CostHistoryStore(path)
+    record(store, "2024-01-01", "2024-02-01", estimated=False)
+    assert store.covering_granularity(REPORT, "2024-01-01", "2024-02-01") == "DAILY"
+    store.close()
@@ -0,0 +1,98 @@
+from aws_billing.planner import TagQueryPlan, plan_tag_queries
+
+A, B, C = "111111111111", "222222222222", "333333333333"
+TAGS = {A: ["", "web-a", "db-a"], B: ["", "web-b"], C: ["api-c"]}
+
+
+def group(keys, amount, start="2024-01-01"):
+    return {
+        "TimePeriod": {"Start": start, "End": "2024-02-01"},
+        "Keys": keys,
+        "Metrics": {"UnblendedCost": {"Amount": str(amount), "Unit": "USD"}},
+    }
+
+
+def fake_query(account_ids, tag_values, by_account):
+    """Answers a coalesced query: unique values by tag, shared ones by
+    account, one group per (account, value) the filter keeps."""
+
+    for account_id in account_ids:
+        for value in TAGS[account_id]:
+            if value not in tag_values:
+                continue
+            amount = len(value) + int(account_id[0])
+            if by_account:
+                yield group([account_id, "BoxUsage"], amount)
+            else:
+                yield group([f"Name${value}", "BoxUsage"], amount)
+
+
+def test_queries_split_unique_and_shared_values():
+    plan = TagQueryPlan("Name", TAGS, chunk_size=2)
+    assert plan.owners[""] == [A, B]
+    assert plan.unique == ["web-a", "db-a", "web-b", "api-c"]
+    assert plan.queries(coalesced=True) == [
+        ([A, B, C], ["web-a", "db-a"], False),
+        ([A, B, C], ["web-b", "api-c"], False),
+        ([A, B], [""], True),
+    ]
+    assert plan.queries(coalesced=False) == [
+        ([A], ["", "web-a"], False),
+        ([A], ["db-a"], False),
+        ([B], ["", "web-b"], False),
+        ([C], ["api-c"], False),
+    ]
+    assert (plan.coalesced_calls, plan.separate_calls) == (3, 4)
+    assert plan.coalesced and plan.saved == 1
+
+
+def test_single_account_is_not_coalesced():
+    plans = plan_tag_queries([("Name", A, TAGS[A])], chunk_size=500)
+    assert not plans["Name"].coalesced
+
+
+def test_fetch_attributes_groups_like_separate_queries():
+    plan = TagQueryPlan("Name", TAGS, chunk_size=2)
+    fetched = {
+        account_id: sorted(
+            (tuple(g["Keys"]), g["Metrics"]["UnblendedCost"]["Amount"]) for g in spool
+        )
+        for account_id, spool in plan.fetch(fake_query, max_workers=2).items()
+    }
+    separate = {
+        account_id: sorted(
+            (tuple(g["Keys"]), g["Metrics"]["UnblendedCost"]["Amount"])
+            for g in fake_query([account_id], values, False)
+        )
+        for account_id, values in TAGS.items()
+    }
+    assert fetched == separate
+    assert fetched[A][0] == (("Name$", "BoxUsage"), "1")
+    assert fetched[B][0] == (("Name$", "BoxUsage"), "2")
+
+
+def test_fetch_skips_values_of_no_account(capsys):
+    plan = TagQueryPlan("Name", {A: ["web-a"], B: ["web-b"]}, chunk_size=500)
+
+    def query(account_ids, tag_values, by_account):
+        yield group(["Name$web-a", "BoxUsage"], 1)
+        yield group(["Name$stray", "BoxUsage"], 2)
+
+    spools = plan.fetch(query)
+    assert [g["Keys"] for g in spools[A]] == [["Name$web-a", "BoxUsage"]]
+    assert list(spools[B]) == []
+    assert "stray" in capsys.readouterr().out
+
+
+def test_fetch_spools_more_groups_than_a_batch():
+    plan = TagQueryPlan("Name", {A: ["web-a"], B: ["web-b"]}, chunk_size=500)
+
+    def query(account_ids, tag_values, by_account):
+        for day in range(2500):
+            yield group(["Name$web-a", "BoxUsage"], day, start=str(day))
+
+    spools = plan.fetch(query)
+    assert [g["Metrics"]["UnblendedCost"]["Amount"] for g in spools[A]] == [
+        str(day) for day in range(2500)
+    ]
+    spools[A].close()
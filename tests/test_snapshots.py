@@ -0,0 +1,62 @@
+from aws_billing import aws_billing
+from aws_billing.history import CostHistoryStore, service_report_id
+from aws_billing.objects.directory import AccountDirectory
+
+START, END = "2024-01-01", "2024-02-01"
+
+
+class FakeCostExplorer:
+    """Answers every get_cost_and_usage query with one month of one group."""
+
+    def __init__(self, estimated):
+        self.estimated = estimated
+        self.calls = 0
+
+    def get_cost_and_usage(self, **request):
+        self.calls += 1
+        return {
+            "ResultsByTime": [
+                {
+                    "TimePeriod": {"Start": START, "End": END},
+                    "Groups": [
+                        {
+                            "Keys": ["111111111111", "EC2"],
+                            "Metrics": {
+                                "UnblendedCost": {"Amount": "5.0", "Unit": "USD"}
+                            },
+                        }
+                    ],
+                    "Estimated": self.estimated,
+                }
+            ]
+        }
+
+
+def snapshot(store, client):
+    return aws_billing.report_snapshot(
+        client, AccountDirectory([]), store, START, END, refresh=True
+    )
+
+
+def test_snapshot_of_stored_estimates_is_not_saved(tmp_path):
+    store = CostHistoryStore(str(tmp_path / "history.sqlite3"))
+    snapshot(store, FakeCostExplorer(estimated=True))
+    store.offline = True
+    snapshot(store, FakeCostExplorer(estimated=True))
+    assert store.has_estimates(service_report_id(), START, END)
+    assert store.load_snapshot(service_report_id(), START, END) is None
+    store.close()
+
+
+def test_snapshot_of_final_rows_is_saved_even_when_read_locally(tmp_path):
+    store = CostHistoryStore(str(tmp_path / "history.sqlite3"))
+    snapshot(store, FakeCostExplorer(estimated=True))
+    store.offline = True
+    client = FakeCostExplorer(estimated=False)
+    snapshot(store, client)
+    assert client.calls == 1  # the closed, estimated month is fetched again
+    local = FakeCostExplorer(estimated=False)
+    rows = snapshot(store, local)
+    assert local.calls == 0
+    assert store.load_snapshot(service_report_id(), START, END) == rows
+    store.close()
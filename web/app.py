@@ -0,0 +1,337 @@
+"""HTTP cost API serving the aws_billing reports from the local history store.
+
+Reports are never fetched from Cost Explorer while a request waits: the
+tables of every covered month are precomputed from the history store (see
+`sync`) and swapped in atomically, and a background thread syncs the store
+and rebuilds them every AWS_BILLING_REFRESH_SECONDS.
+
+Run from the repository root, so the aws_billing package is importable:
+
+    python3 -m flask --app web/app.py run
+"""
+
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from flask import Flask, Response, abort, jsonify, request, url_for
+
+from aws_billing import aws_billing
+from aws_billing.account_cache import AccountCache
+from aws_billing.aws_billing import ACCOUNT_HEADERS, SERVICE_HEADERS, TAG_HEADERS
+from aws_billing.history import CostHistoryStore, service_report_id
+from aws_billing.objects.classes import Account
+from aws_billing.objects.directory import AccountDirectory
+
+REFRESH_SECONDS = int(os.getenv("AWS_BILLING_REFRESH_SECONDS", "3600"))
+SYNC_SINCE_DAYS = int(os.getenv("AWS_BILLING_SYNC_SINCE_DAYS", "62"))
+
+
+def load_account_directory(profile):
+    """Returns the cached account list of a profile, expired or not."""
+    records = AccountCache(profile).load(allow_stale=True) or []
+    return AccountDirectory([Account.trusted(**record) for record in records])
+
+
+def covered_months(intervals):
+    """Yields (month, start, end) for every month touched by the coverage
+    intervals, clipped to them, e.g. ("2024-01", "2024-01-01", "2024-02-01");
+    a partially synced month ends early, e.g. ("2024-02", "2024-02-01",
+    "2024-02-15")."""
+
+    months = {}
+    for _, start, end in intervals:
+        day = datetime.date.fromisoformat(start)
+        last = datetime.date.fromisoformat(end)
+        while day < last:
+            following = (day.replace(day=28) + datetime.timedelta(days=4)).replace(
+                day=1
+            )
+            month = day.strftime("%Y-%m")
+            span = (day.isoformat(), min(following, last).isoformat())
+            if month in months:
+                span = (min(months[month][0], span[0]), max(months[month][1], span[1]))
+            months[month] = span
+            day = following
+    for month, (start, end) in sorted(months.items()):
+        yield month, start, end
+
+
+class Table:
+    """A precomputed report table with its ETag.
+
+    start and end are the period the rows cover, which is shorter than the
+    month for a month the store has only partially synced.
+    """
+
+    def __init__(self, headers, rows, start, end):
+        self.headers = headers
+        self.rows = rows
+        self.start = start
+        self.end = end
+        digest = hashlib.sha256(
+            json.dumps([headers, rows, start, end], default=str).encode()
+        )
+        self.etag = digest.hexdigest()[:32]
+
+    def period(self):
+        """Returns the start, end and completeness of the covered period."""
+        start = datetime.date.fromisoformat(self.start)
+        end = datetime.date.fromisoformat(self.end)
+        complete = start.day == 1 and end == (
+            start.replace(day=28) + datetime.timedelta(days=4)
+        ).replace(day=1)
+        return {"start": self.start, "end": self.end, "complete": complete}
+
+
+class Rollups:
+    """Monthly account, service and tag tables built from the history store.
+
+    rebuild() computes every table into a new dict and replaces the old one
+    in a single assignment, so readers always see a complete generation.
+    """
+
+    def __init__(self, profile=None, store_path=None):
+        self.profile = profile
+        self.store_path = store_path
+        self.built_at = None
+        self._tables = {}
+
+    def get(self, key):
+        return self._tables.get(key)
+
+    def keys(self):
+        return list(self._tables)
+
+    def items(self):
+        return sorted(self._tables.items(), key=lambda item: item[0])
+
+    def rebuild(self):
+        from aws_billing.rules import default_rules
+
+        store = CostHistoryStore(self.store_path, payer=self.profile, offline=True)
+        accounts = load_account_directory(self.profile)
+        tables = {}
+        try:
+            for report, intervals in store.coverage().items():
+                for month, start, end in covered_months(intervals):
+                    if not store.covering_granularity(report, start, end):
+                        continue
+                    if report == service_report_id():
+                        account_table, service_table, _ = (
+                            aws_billing.aws_billing_with_rollups(
+                                None, start, end, accounts, store=store, show=False
+                            )
+                        )
+                        tables[("accounts", month)] = Table(
+                            ACCOUNT_HEADERS, account_table, start, end
+                        )
+                        tables[("services", month)] = Table(
+                            SERVICE_HEADERS, service_table, start, end
+                        )
+                        continue
+                    _, tag_key, account_id = report.split(":", 2)
+                    splits = ("", *default_rules().buckets(account_id))
+                    split_tables = aws_billing.aws_billing_ec2_volume_snapshot_splits(
+                        None,
+                        start,
+                        end,
+                        accounts,
+                        account_id,
+                        tag_key,
+                        [],
+                        splits=splits,
+                        show=False,
+                        store=store,
+                    )
+                    for split, table in split_tables.items():
+                        tables[("tags", tag_key, account_id, split, month)] = Table(
+                            TAG_HEADERS, table, start, end
+                        )
+        finally:
+            store.close()
+        self._tables = tables
+        self.built_at = time.time()
+
+
+def sync_and_rebuild(rollups, job_file=None):
+    """Fetches new cost data into the history store, then rebuilds rollups.
+
+    Runs the same sync as `python -m aws_billing.aws_billing sync`, for the
+    service report and the tag reports of job_file.
+    """
+
+    from aws_billing import aws_billing
+
+    profile = rollups.profile
+    tag_reports = []
+    if job_file:
+        from aws_billing.objects.jobs import load_job_spec
+
+        spec = load_job_spec(job_file)
+        tag_reports = list(
+            dict.fromkeys(
+                (tag_report.account_name, tag_report.tag_key)
+                for entity in spec.entities
+                for tag_report in entity.tag_reports
+            )
+        )
+    account_list = aws_billing.get_account_directory(profile)
+    ce_client, cache = aws_billing.open_ce_client(profile)
+    store = CostHistoryStore(rollups.store_path, payer=profile)
+    since = datetime.date.today() - datetime.timedelta(days=SYNC_SINCE_DAYS)
+    try:
+        aws_billing.sync_history(
+            ce_client, account_list, store, since.isoformat(), tag_reports
+        )
+    finally:
+        store.close()
+        if cache:
+            cache.close()
+    rollups.rebuild()
+
+
+def start_refresher(rollups, interval, job_file=None):
+    """Starts a daemon thread running sync_and_rebuild every interval seconds.
+
+    Failures are printed and retried at the next interval; the previous
+    tables keep being served meanwhile.
+    """
+
+    def refresh_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                sync_and_rebuild(rollups, job_file)
+            except Exception as e:
+                print(f"Background refresh failed: {e}")
+
+    thread = threading.Thread(target=refresh_forever, name="refresher", daemon=True)
+    thread.start()
+    return thread
+
+
+def stream_csv(headers, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in [headers, *rows]:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_json(headers, rows):
+    yield "["
+    for i, row in enumerate(rows):
+        yield ("," if i else "") + json.dumps(dict(zip(headers, row)))
+    yield "]\n"
+
+
+def table_response(table):
+    """Streams a Table as CSV or JSON, answering 304 to a matching
+    If-None-Match."""
+
+    if table.etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(table.etag)
+        return response
+    csv_requested = request.args.get("format") == "csv" or (
+        "format" not in request.args
+        and request.accept_mimetypes.best_match(["application/json", "text/csv"])
+        == "text/csv"
+    )
+    if csv_requested:
+        response = Response(stream_csv(table.headers, table.rows), mimetype="text/csv")
+    else:
+        response = Response(
+            stream_json(table.headers, table.rows), mimetype="application/json"
+        )
+    response.set_etag(table.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Report-Period"] = f"{table.start}/{table.end}"
+    return response
+
+
+def create_app(profile=None, store_path=None, refresh=REFRESH_SECONDS, job_file=None):
+    """Builds the Flask app and its rollups.
+
+    Args:
+        profile: The payer's AWS profile (default: AWS_PROFILE).
+        store_path: The history store file (default: the CACHE_DIR store).
+        refresh: Seconds between background syncs; 0 disables them.
+        job_file: A batch job file whose tag reports are synced too
+            (default: AWS_BILLING_JOB_FILE).
+    """
+
+    app = Flask(__name__)
+    rollups = Rollups(profile or os.getenv("AWS_PROFILE"), store_path)
+    rollups.rebuild()
+    if refresh:
+        start_refresher(rollups, refresh, job_file or os.getenv("AWS_BILLING_JOB_FILE"))
+    app.extensions["rollups"] = rollups
+
+    def lookup(*key):
+        table = rollups.get(key)
+        if table is None:
+            abort(404)
+        return table_response(table)
+
+    @app.get("/healthz")
+    def healthz():
+        return jsonify(built_at=rollups.built_at, tables=len(rollups.keys()))
+
+    @app.get("/reports")
+    def reports():
+        listing = []
+        for key, table in rollups.items():
+            period = table.period()
+            if key[0] == "tags":
+                _, tag_key, account_id, split, month = key
+                href = url_for(
+                    "tag_report",
+                    month=month,
+                    tag_key=tag_key,
+                    account_id=account_id,
+                    split=split or None,
+                )
+                listing.append(
+                    {
+                        "report": "tags",
+                        "month": month,
+                        "tag_key": tag_key,
+                        "account_id": account_id,
+                        "split": split,
+                        **period,
+                        "href": href,
+                    }
+                )
+            else:
+                report, month = key
+                href = url_for(f"{report}_report", month=month)
+                listing.append(
+                    {"report": report, "month": month, **period, "href": href}
+                )
+        return jsonify(listing)
+
+    @app.get("/reports/<month>/accounts")
+    def accounts_report(month):
+        return lookup("accounts", month)
+
+    @app.get("/reports/<month>/services")
+    def services_report(month):
+        return lookup("services", month)
+
+    @app.get("/reports/<month>/tags/<tag_key>/<account_id>")
+    def tag_report(month, tag_key, account_id):
+        return lookup("tags", tag_key, account_id, request.args.get("split", ""), month)
+
+    return app
+
+
+app = create_app()